@@ -1,23 +1,39 @@
+import copy
+import io
 import math
 import os
+import pickle
 import sys
+from array import array
 from collections import defaultdict
-from typing import List, Tuple, Text, Dict
+from typing import List, Tuple, Text, Dict, Iterator, Optional, Set, TextIO
 
 
 class Point():
     '''
     Point on the space map
+
+    Points are immutable, so that they can be used as dictionary keys, and have no attribute dictionary, so that they
+    are small.
     '''
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
-        self.x = x
-        self.y = y
+        object.__setattr__(self, 'x', x)
+        object.__setattr__(self, 'y', y)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'Points are immutable, cannot set {name}')
+
+    def __reduce__(self):
+        # Rebuilt through __init__, as __setattr__ prevents pickle and copy from setting the slots
+        return Point, (self.x, self.y)
 
     def __repr__(self):
         return f'({self.x}, {self.y})'
 
     def __hash__(self):
-        return self.__repr__().__hash__()
+        return hash((self.x, self.y))
 
     def __add__(self, other):
         return Point(self.x + other.x, self.y + other.y)
@@ -47,6 +63,288 @@ class Point():
     def __lt__(self, other):
         return self.y < other.y or (self.y == other.y and self.x < other.x)
 
+def grow_bounds(min_x, min_y, width, height, x, y):
+    # type: (int, int, int, int, int, int) -> Tuple[int, int, int, int]
+    '''
+    Returns the bounds (min_x, min_y, width, height) of a rectangle grown to contain the cell (x, y), its width or
+    height being at least doubled when it grows, so that growing cell by cell costs amortized constant time.
+    '''
+    max_x, max_y = min_x + width, min_y + height
+    if width == 0 or height == 0:
+        return x, y, 1, 1
+    if x < min_x:
+        min_x = min(x, max_x - 2 * width)
+    elif x >= max_x:
+        max_x = max(x + 1, min_x + 2 * width)
+    if y < min_y:
+        min_y = min(y, max_y - 2 * height)
+    elif y >= max_y:
+        max_y = max(y + 1, min_y + 2 * height)
+    return min_x, min_y, max_x - min_x, max_y - min_y
+
+class TextRenderer():
+    '''
+    Text display of a grid, keeping a buffer of its characters.
+
+    Characters are drawn in the buffer, which grows to contain every drawn cell. Each frame only rewrites the rows
+    changed since the previous one, moving the cursor with ANSI escape codes, and is sent to the stream in a single
+    write, so that maps can be animated at high frame rates.
+    '''
+    def __init__(self, blank=' ', stream=None):
+        # type: (Text, Optional[TextIO]) -> None
+        self.blank = blank
+        self.stream = stream or sys.stdout
+        self.min_x, self.min_y = 0, 0
+        self.width, self.height = 0, 0
+        self.rows = [] # type: List[List[Text]]
+        self.changed_rows = set() # type: Set[int]
+        self.title = None # type: Optional[Text]
+        self.cleared = False
+        if sys.platform == 'win32':
+            os.system('') # Enables the escape codes in the Windows console
+
+    def resize(self, x, y):
+        # type: (int, int) -> None
+        '''
+        Grows the buffer so that it contains the cell (x, y), doubling its width or height when needed.
+        '''
+        min_x, min_y, width, height = grow_bounds(self.min_x, self.min_y, self.width, self.height, x, y)
+        rows = [[self.blank] * width for _ in range(height)]
+        for row_index, row in enumerate(self.rows):
+            start = self.min_x - min_x
+            rows[self.min_y - min_y + row_index][start:start + self.width] = row
+        self.min_x, self.min_y, self.width, self.height = min_x, min_y, width, height
+        self.rows = rows
+        self.changed_rows = set(range(self.height))
+        self.cleared = False
+
+    def draw(self, x, y, char):
+        # type: (int, int, Text) -> None
+        '''
+        Draws a character in the cell (x, y).
+        '''
+        column, row_index = x - self.min_x, y - self.min_y
+        if not (0 <= column < self.width and 0 <= row_index < self.height):
+            self.resize(x, y)
+            column, row_index = x - self.min_x, y - self.min_y
+        row = self.rows[row_index]
+        if row[column] != char:
+            row[column] = char
+            self.changed_rows.add(row_index)
+
+    def text(self):
+        # type: () -> Text
+        '''
+        Returns the buffer as lines of text, without escape codes nor the blank rows and columns on its edges.
+        '''
+        lines = [''.join(row) for row in self.rows]
+        drawn_rows = [y for y, line in enumerate(lines) if line.strip(self.blank)]
+        if not drawn_rows:
+            return ''
+        start = min(len(line) - len(line.lstrip(self.blank)) for line in lines if line.strip(self.blank))
+        end = max(len(line.rstrip(self.blank)) for line in lines)
+        return '\n'.join(line[start:end] for line in lines[drawn_rows[0]:drawn_rows[-1] + 1])
+
+    def render(self, title=None):
+        # type: (Optional[Text]) -> None
+        '''
+        Displays the rows changed since the previous frame, below a title line if one is given.
+        '''
+        top = 1 if title is not None else 0
+        frame = []
+        if not self.cleared or (title is None) != (self.title is None):
+            # The rows move when the title line appears or disappears
+            frame.append('\x1b[2J')
+            self.changed_rows = set(range(self.height))
+            self.cleared = True
+            self.title = None
+        if title != self.title:
+            frame.append(f'\x1b[1;1H{title}\x1b[K')
+            self.title = title
+        for row_index in sorted(self.changed_rows):
+            frame.append(f'\x1b[{top + row_index + 1};1H' + ''.join(self.rows[row_index]))
+        self.changed_rows.clear()
+        frame.append(f'\x1b[{top + self.height + 1};1H')
+        self.stream.write(''.join(frame))
+        self.stream.flush()
+
+class Grid():
+    '''
+    Dense map of small integers, indexed by points.
+
+    Cells are stored line by line in an array of the given typecode (signed bytes by default), the first cell being
+    (min_x, min_y). The array grows to contain every cell set, doubling its width or height when needed (see
+    grow_bounds), and cells outside of it have the default value. Lines are slices of the array, so that counting,
+    comparing or displaying cells run at C speed instead of looping over points.
+    '''
+    def __init__(self, default=0, typecode='b'):
+        # type: (int, Text) -> None
+        self.default = default
+        self.typecode = typecode
+        self.min_x, self.min_y = 0, 0
+        self.width, self.height = 0, 0
+        self.cells = array(typecode)
+
+    @classmethod
+    def from_cells(cls, cells, width, default=0):
+        # type: (bytes, int, int) -> Grid
+        '''
+        Creates a grid of bytes from its cells line by line, the first cell being (0, 0).
+        '''
+        grid = cls(default)
+        grid.cells.frombytes(cells)
+        grid.width, grid.height = width, len(cells) // width if width else 0
+        return grid
+
+    @classmethod
+    def from_rows(cls, rows, default=0):
+        # type: (List[bytes], int) -> Grid
+        '''
+        Creates a grid of bytes from its lines, the first cell being (0, 0). Short lines are padded with the default
+        value.
+        '''
+        grid = cls(default)
+        grid.width, grid.height = max(map(len, rows), default=0), len(rows)
+        padding = array('b', [default]).tobytes()
+        for row in rows:
+            grid.cells.frombytes(row + padding * (grid.width - len(row)))
+        return grid
+
+    def mask(self, value):
+        # type: (int) -> int
+        '''
+        Returns an integer whose bit y * width + x is set if the cell (min_x + x, min_y + y) has a value, the typecode
+        being a byte one. Neighbour cells are then found for all the cells at once by shifting the mask, by 1 for the
+        horizontal ones and by the width for the vertical ones.
+        '''
+        table = bytes(0x31 if byte == value & 0xff else 0x30 for byte in range(256))
+        return int(self.cells.tobytes().translate(table)[::-1] or b'0', 2)
+
+    def points(self, mask):
+        # type: (int) -> Iterator[Point]
+        '''
+        Iterates over the points of the cells whose bit is set in a mask.
+        '''
+        bits = format(mask, 'b')[::-1]
+        index = bits.find('1')
+        while index != -1:
+            yield Point(self.min_x + index % self.width, self.min_y + index // self.width)
+            index = bits.find('1', index + 1)
+
+    def resize(self, x, y):
+        # type: (int, int) -> None
+        '''
+        Grows the array so that it contains the cell (x, y).
+        '''
+        min_x, min_y, width, height = grow_bounds(self.min_x, self.min_y, self.width, self.height, x, y)
+        cells = array(self.typecode, [self.default]) * (width * height)
+        start = (self.min_y - min_y) * width + self.min_x - min_x
+        for row_index in range(self.height):
+            row_start = start + row_index * width
+            cells[row_start:row_start + self.width] = self.cells[row_index * self.width:(row_index + 1) * self.width]
+        self.min_x, self.min_y, self.width, self.height = min_x, min_y, width, height
+        self.cells = cells
+
+    def get(self, x, y):
+        # type: (int, int) -> int
+        '''
+        Returns the value of the cell (x, y).
+        '''
+        x -= self.min_x
+        y -= self.min_y
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[y * self.width + x]
+        return self.default
+
+    def set(self, x, y, value):
+        # type: (int, int, int) -> None
+        '''
+        Sets the value of the cell (x, y).
+        '''
+        if not (0 <= x - self.min_x < self.width and 0 <= y - self.min_y < self.height):
+            self.resize(x, y)
+        self.cells[(y - self.min_y) * self.width + x - self.min_x] = value
+
+    def __getitem__(self, point):
+        # type: (Point) -> int
+        return self.get(point.x, point.y)
+
+    def __setitem__(self, point, value):
+        # type: (Point, int) -> None
+        self.set(point.x, point.y, value)
+
+    def neighbours(self, point):
+        # type: (Point) -> List[int]
+        '''
+        Returns the values of the cells above, right of, below and left of a point.
+        '''
+        x, y = point.x, point.y
+        return [self.get(x, y - 1), self.get(x + 1, y), self.get(x, y + 1), self.get(x - 1, y)]
+
+    def copy(self):
+        # type: () -> Grid
+        grid = Grid(self.default, self.typecode)
+        grid.min_x, grid.min_y, grid.width, grid.height = self.min_x, self.min_y, self.width, self.height
+        grid.cells = array(self.typecode, self.cells)
+        return grid
+
+    def count(self, value):
+        # type: (int) -> int
+        '''
+        Counts the cells having a value, which must not be the default one.
+        '''
+        return self.cells.count(value)
+
+    def rows(self):
+        # type: () -> Iterator[Tuple[int, array]]
+        '''
+        Iterates over the lines of the array, with their ordinate.
+        '''
+        for row_index in range(self.height):
+            yield self.min_y + row_index, self.cells[row_index * self.width:(row_index + 1) * self.width]
+
+    def items(self):
+        # type: () -> Iterator[Tuple[Point, int]]
+        '''
+        Iterates over the cells not having the default value, line by line.
+        '''
+        default_row = array(self.typecode, [self.default]) * self.width
+        for y, row in self.rows():
+            if row != default_row:
+                for column, value in enumerate(row):
+                    if value != self.default:
+                        yield Point(self.min_x + column, y), value
+
+    def bounds(self):
+        # type: () -> Optional[Tuple[int, int, int, int]]
+        '''
+        Returns the smallest rectangle (min_x, min_y, max_x, max_y) containing the cells not having the default value,
+        or None if all of them have it.
+        '''
+        default, default_row = self.default, array(self.typecode, [self.default]) * self.width
+        rows = [(y, row) for y, row in self.rows() if row != default_row]
+        if not rows:
+            return None
+        min_column = min(next(i for i, value in enumerate(row) if value != default) for _, row in rows)
+        max_column = max(self.width - next(i for i, value in enumerate(reversed(row)) if value != default)
+                         for _, row in rows) - 1
+        return self.min_x + min_column, rows[0][0], self.min_x + max_column, rows[-1][0]
+
+    def text(self, symbols):
+        # type: (Dict[int, Text]) -> Text
+        '''
+        Returns the lines of the rectangle containing the cells not having the default value, each value being
+        replaced by its symbol. The typecode must be a byte one.
+        '''
+        bounds = self.bounds()
+        if bounds is None:
+            return ''
+        min_x, min_y, max_x, max_y = bounds
+        table = {value & 0xff: symbol for value, symbol in symbols.items()}
+        start, end = min_x - self.min_x, max_x - self.min_x + 1
+        return '\n'.join(row[start:end].tobytes().decode('latin-1').translate(table)
+                         for y, row in self.rows() if min_y <= y <= max_y)
+
 SpaceMap = List[List[int]]
 
 def get_asteroids_positions(space_map):
@@ -225,8 +523,53 @@ def checks_d10p2():
     for rank, asteroid in results:
         assert vaporized[rank - 1] == asteroid
 
+def checks_text_renderer():
+    stream = io.StringIO()
+    renderer = TextRenderer('.', stream)
+    renderer.draw(1, 1, '#')
+    renderer.draw(-1, 0, '#')
+    assert renderer.text() == '#..\n..#'
+    renderer.render()
+    assert stream.getvalue() == '\x1b[2J\x1b[1;1H#..\x1b[2;1H..#\x1b[3;1H'
+    renderer.draw(0, 1, '@')
+    renderer.draw(1, 0, '.')
+    renderer.render('Title')
+    assert stream.getvalue().endswith('\x1b[2J\x1b[1;1HTitle\x1b[K\x1b[2;1H#..\x1b[3;1H.@#\x1b[4;1H')
+    renderer.draw(0, 0, '@')
+    renderer.render('Title')
+    assert stream.getvalue().endswith('\x1b[4;1H\x1b[2;1H#@.\x1b[4;1H')
+
+    renderer = TextRenderer()
+    for x in range(3):
+        renderer.draw(x, x, '#')
+    assert (renderer.width, renderer.height) == (4, 4)
+    assert renderer.text() == '#  \n # \n  #'
+
+def checks_grid():
+    grid = Grid(-1)
+    for x, y, value in [(1, 1, 2), (3, 2, 0), (-2, 0, 1)]:
+        grid[Point(x, y)] = value
+    assert (grid[Point(1, 1)], grid[Point(0, 0)], grid[Point(10, -10)]) == (2, -1, -1)
+    assert grid.neighbours(Point(1, 0)) == [-1, -1, 2, -1]
+    assert grid.bounds() == (-2, 0, 3, 2)
+    assert list(grid.items()) == [(Point(-2, 0), 1), (Point(1, 1), 2), (Point(3, 2), 0)]
+    assert grid.text({-1: ' ', 0: '.', 1: '#', 2: '@'}) == '#     \n   @  \n     .'
+    assert grid.copy().cells == grid.cells and grid.count(-1) == len(grid.cells) - 3
+    assert list(grid.points(grid.mask(2) | grid.mask(0))) == [Point(1, 1), Point(3, 2)]
+
+    points = {Point(1, 2): 3}
+    assert pickle.loads(pickle.dumps(points)) == copy.deepcopy(points) == points
+    assert copy.copy(Point(-1, 0)) == Point(-1, 0)
+
+    grid = Grid.from_rows([b'#.', b'', b'.##'])
+    assert (grid.width, grid.height, grid.get(2, 2), grid.get(1, 1)) == (3, 3, 35, 0)
+    assert grid.mask(35) == 0b110000001
+
 def run(with_tests = True):
-    if with_tests: checks_d10p1()
+    if with_tests:
+        checks_text_renderer()
+        checks_grid()
+        checks_d10p1()
 
     best_spot, d10p1 = find_best_spot(read_space_map('input'))
     print(f'Day 10, Part 1 : {d10p1}') # 263
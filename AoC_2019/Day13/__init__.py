@@ -1,14 +1,14 @@
-import ast, os
-import sys
+import ast, asyncio, os
 from collections import defaultdict
-from time import sleep
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-from Day10 import Point
-from Day9 import run_program, NewProgram
+from Day10 import Point, TextRenderer, Grid
+from Day9 import run_program, NewProgram, IntcodeVM, AsyncIntcodeVM, InputChannel
 
 GameMap = Dict[Point, int]
 
+tile_symbols = [' ', '█', '░', '▬', '●']
+
 def count_tiles(program, tile_type):
     # type: (NewProgram, int) -> int
     '''
@@ -37,24 +37,18 @@ def update_game_map(output, game_map=None):
 
     return game_map
 
-def print_game_map(game_map):
-    # type: (GameMap) -> None
-    '''
-    Print the game map in text mode
-    '''
-    if sys.platform == 'win32':
-        os.system('cls')
-    else:
-        os.system('clear')
-    symbols = [' ', '█', '░', '▬', '●']
-    max_x = max([p.x for p in game_map])
-    max_y = max([p.y for p in game_map])
-    print(f'Score: {game_map[Point(-1, 0)]}')
-    for y in range(0, max_y + 1):
-        for x in range(0, max_x + 1):
-            value = game_map[Point(x, y)]
-            sys.stdout.write(symbols[value])
-        print('')
+def print_game_map(game_map, renderer=None):
+    # type: (GameMap, Optional[TextRenderer]) -> TextRenderer
+    '''
+    Print the game map in text mode, and returns the renderer. Giving back the renderer of the previous frame only
+    prints the rows which have changed since then.
+    '''
+    renderer = renderer or TextRenderer()
+    for point, value in game_map.items():
+        if point.x >= 0:
+            renderer.draw(point.x, point.y, tile_symbols[value])
+    renderer.render(f'Score: {game_map[Point(-1, 0)]}')
+    return renderer
 
 def find_object(game_map, object):
     # type: (GameMap, int) -> Point
@@ -65,36 +59,149 @@ def find_object(game_map, object):
         if value == object:
             return p
 
-def play(program, fps=0):
+class GameState():
+    '''
+    State of the game, updated from the program's output as it is produced.
+
+    The positions of the ball and of the paddle, the score and the number of blocks are updated with each tile drawn,
+    so that the cost of a frame depends on the number of tiles it draws, not on the size of the board. Output values
+    not forming a complete tile yet are kept until the next update. The tiles are also drawn by the renderer, if any.
+    '''
+    def __init__(self, renderer=None):
+        # type: (Optional[TextRenderer]) -> None
+        self.renderer = renderer
+        self.game_map = Grid()
+        self.ball = None # type: Optional[Point]
+        self.paddle = None # type: Optional[Point]
+        self.score = 0
+        self.nb_blocks = 0
+        self.pending = [] # type: List[int]
+
+    def update(self, output):
+        # type: (List[int]) -> GameState
+        '''
+        Draws the tiles of the program's output.
+        '''
+        if self.pending:
+            output = self.pending + output
+        end = len(output) - len(output) % 3
+        self.pending = output[end:]
+        game_map = self.game_map
+        for i in range(0, end, 3):
+            x, y, value = output[i:i + 3]
+            if x == -1 and y == 0:
+                self.score = value
+                continue
+            self.nb_blocks += (value == 2) - (game_map.get(x, y) == 2)
+            if value == 3:
+                self.paddle = Point(x, y)
+            elif value == 4:
+                self.ball = Point(x, y)
+            if self.renderer is not None:
+                self.renderer.draw(x, y, tile_symbols[value])
+            game_map.set(x, y, value)
+        return self
+
+    def joystick(self):
+        # type: () -> int
+        '''
+        Returns the joystick position moving the paddle towards the ball.
+        '''
+        if self.ball is None or self.paddle is None:
+            return 0
+        return (self.ball.x > self.paddle.x) - (self.ball.x < self.paddle.x)
+
+async def render_game(state, fps, game):
+    # type: (GameState, int, asyncio.Future) -> None
+    '''
+    Displays the game fps times per second until it ends, then a last time.
+    '''
+    while not game.done():
+        state.renderer.render(f'Score: {state.score}')
+        await asyncio.sleep(1 / fps)
+    state.renderer.render(f'Score: {state.score}')
+
+async def play_session(vm, state):
+    # type: (AsyncIntcodeVM, GameState) -> int
+    '''
+    Plays the game until it ends, moving the paddle towards the ball, and returns the final score.
+    '''
+    while not vm.halted:
+        state.update(await vm.read_until_input())
+        if vm.halted:
+            break
+        await vm.write(state.joystick())
+    return state.score
+
+async def play_async(program, fps=0):
     # type: (NewProgram, int) -> int
     '''
-    Play the game until it ends
-    '''
-    program[0] = 2
-    pointer = 0
-    relative_base = 0
-    input = []
-    game_map = None
-    while pointer != -1:
-        program, output, pointer, relative_base = run_program(program, input, pointer, True, relative_base)
-        game_map = update_game_map(output, game_map)
-        if fps:
-            print_game_map(game_map)
-            sleep(1 / fps)
-        paddle_pos = find_object(game_map, 3)
-        ball_pos = find_object(game_map, 4)
-        if (ball_pos is None or paddle_pos is None):
-            input = [0]
-            continue
-        input = [(ball_pos.x > paddle_pos.x) - (ball_pos.x < paddle_pos.x)]
+    Plays the game until it ends. When fps is given, the game map is printed fps times per second by a separate
+    coroutine, so that rendering does not slow down the game.
+    '''
+    vm = IntcodeVM(program)
+    vm.memory[0] = 2
+    state = GameState(TextRenderer() if fps else None)
+    game = asyncio.ensure_future(play_session(AsyncIntcodeVM(vm), state))
     if fps:
-        print_game_map(update_game_map(output, game_map))
-    return game_map[Point(-1, 0)]
+        await render_game(state, fps, game)
+    return await game
+
+def play_headless(program):
+    # type: (NewProgram) -> int
+    '''
+    Plays the game in a single run of the program, and returns the final score.
+
+    The joystick position is computed by the input callback, from the tiles drawn since the previous input, so the
+    program never pauses.
+    '''
+    state = GameState()
+    output = []
+
+    def joystick():
+        state.update(output)
+        output.clear()
+        return state.joystick()
+
+    vm = IntcodeVM(program, InputChannel(callback=joystick))
+    vm.memory[0] = 2
+    vm.run_until_output(output=output)
+    return state.update(output).score
+
+def play(program, fps=0):
+    # type: (NewProgram, int) -> int
+    '''
+    Play the game until it ends, headless if fps is 0.
+    '''
+    if not fps:
+        return play_headless(program)
+    return asyncio.run(play_async(program, fps))
+
+def checks_game_state(program):
+    _, output, _, _ = run_program(program)
+    state = GameState()
+    for i in range(0, len(output), 100):
+        state.update(output[i:i + 100])
+    game_map = update_game_map(output)
+    assert all(state.game_map[point] == value for point, value in game_map.items() if point.x >= 0)
+    assert state.nb_blocks == state.game_map.count(2) == count_tiles(program, 2)
+    assert state.ball == find_object(game_map, 4) and state.paddle == find_object(game_map, 3)
+    assert not state.pending
+
+    state = GameState().update([1, 2, 2, 3, 2, 2, 1, 2, 0, -1, 0, 42, 5])
+    assert (state.nb_blocks, state.score, state.pending) == (1, 42, [5])
+
+def checks_play(program):
+    assert play_headless(program) == asyncio.run(play_async(program))
 
 def run(with_tests = True):
     with open(os.path.dirname(__file__) + os.sep + 'input.txt', 'r') as in_file:
         program = ast.literal_eval('[' + in_file.read().strip() + ']')
 
+    if with_tests:
+        checks_game_state(program)
+        checks_play(program)
+
     d13p1 = count_tiles(program, 2)
     print(f'Day 13, Part 1 : {d13p1}') # 326
 
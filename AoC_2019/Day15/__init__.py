@@ -1,59 +1,48 @@
-import ast, os
+import ast, asyncio, os
 import sys
-from collections import defaultdict
-from typing import Dict, Tuple
+from typing import Tuple, Optional
 
-from Day10 import Point
-from Day9 import run_program, Program
+from Day10 import Point, TextRenderer, Grid
+from Day9 import IntcodeVM, AsyncIntcodeVM, Program
 
-SectionMap = Dict[Point, int]
+SectionMap = Grid
 
 directions = [Point(0, -1), Point(0, 1), Point(-1, 0), Point(1, 0)]
 next_direction = [2, 3, 1, 0] # next_direction[i] is the direction to take if the droid hit the wall when moving in
                               # direction i. This keeps the wall to the right.
+opposite_direction = [1, 0, 3, 2]
 
-def print_map(section_map, droid_position):
-    # type: (SectionMap, Point) -> None
+def print_map(section_map, droid_position, renderer=None):
+    # type: (SectionMap, Point, Optional[TextRenderer]) -> TextRenderer
     '''
-    Prints the map in text mode.
+    Prints the map in text mode, and returns the renderer. Giving back the renderer of the previous frame only prints
+    the rows which have changed since then.
     '''
-    if sys.platform == 'win32':
-        os.system('cls')
-    else:
-        os.system('clear')
-
-    xs = [p.x for p in section_map]
-    min_x, max_x = min(xs), max(xs)
-    ys = [p.y for p in section_map]
-    min_y, max_y = min(ys), max(ys)
-
     symbols = {-2: '░', -1: '█', 1: ' ', 2: '●', 3: '¤', 4: '☺'}
-    for y in range(min_y, max_y + 1):
-        for x in range(min_x, max_x + 1):
-            if Point(x, y) == droid_position:
-                sys.stdout.write(symbols[4])
-            else:
-                value = section_map[Point(x, y)]
-                sys.stdout.write(symbols[value])
-        print('')
+    renderer = renderer or TextRenderer(symbols[-2])
+    for point, value in section_map.items():
+        renderer.draw(point.x, point.y, symbols[value])
+    renderer.draw(droid_position.x, droid_position.y, symbols[4])
+    renderer.render()
+    return renderer
 
-def build_map(program):
-    # type: (Program) -> Tuple[SectionMap, SectionMap, Point]
+async def follow_wall(droid):
+    # type: (AsyncIntcodeVM) -> Tuple[SectionMap, SectionMap, Point]
     '''
-    Builds the section map by keeping the wall to the right
+    Builds the section map by keeping the wall to the right, so that several droids can explore concurrently.
     '''
-    section_map = defaultdict(lambda: -2, {Point(0, 0): 3})
-    distance_map = defaultdict(lambda: sys.maxsize, {Point(0,0): 0})
+    section_map = Grid(-2)
+    section_map[Point(0, 0)] = 3
+    distance_map = Grid(sys.maxsize, 'q')
+    distance_map[Point(0, 0)] = 0
 
-    pointer = 0
-    relative_base = 0
     direction = 1
     position = Point(0, 0)
     oxygen_system_location = None
 
-    while pointer != -1:
-        program, output, pointer, relative_base = run_program(program, [direction + 1], pointer, True, relative_base)
-        result = output[0]
+    while not droid.halted:
+        await droid.write(direction + 1)
+        result = await droid.read()
         if result == 0:
             section_map[position + directions[direction]] = -1
             # Droid hit a wall, change the direction to keep the wall on the right
@@ -71,34 +60,159 @@ def build_map(program):
             break
     return section_map, distance_map, oxygen_system_location
 
+def build_map(program):
+    # type: (Program) -> Tuple[SectionMap, Point]
+    '''
+    Builds the section map with a depth first search driving a single droid.
+
+    The droid probes each unknown position next to it, moving forward when it can, and goes back along its path once
+    all the positions around it are known. Each position is thus probed once and each corridor walked twice, whatever
+    the shape of the section. Returns the map and the location of the oxygen system, from which get_distances gives
+    the distances.
+    '''
+    section_map = Grid(-2)
+    section_map[Point(0, 0)] = 3
+    oxygen_system_location = None
+
+    vm = IntcodeVM(program)
+    position = Point(0, 0)
+    path = []
+    while True:
+        for direction in range(0, 4):
+            next_position = position + directions[direction]
+            if section_map[next_position] == -2:
+                break
+        else:
+            if not path:
+                break
+            # All the positions around are known, back to the previous one
+            direction = opposite_direction[path.pop()]
+            vm.feed([direction + 1]).run_until_output(1)
+            position += directions[direction]
+            continue
+
+        result = vm.feed([direction + 1]).run_until_output(1)[0]
+        if result == 0:
+            section_map[next_position] = -1
+            continue
+        section_map[next_position] = result
+        if result == 2:
+            oxygen_system_location = next_position
+        position = next_position
+        path.append(direction)
+
+    return section_map, oxygen_system_location
+
+def explore_map(program):
+    # type: (Program) -> Tuple[SectionMap, SectionMap, Point]
+    '''
+    Builds the section map with a breadth first search.
+
+    The droid's computer is forked at each position, so that every branch of the search continues from the state in
+    which the droid reached it, instead of driving the droid back and forth.
+    '''
+    section_map = Grid(-2)
+    section_map[Point(0, 0)] = 3
+    distance_map = Grid(sys.maxsize, 'q')
+    distance_map[Point(0, 0)] = 0
+    oxygen_system_location = None
+
+    frontier = [(Point(0, 0), IntcodeVM(program))]
+    while frontier:
+        next_frontier = []
+        for position, vm in frontier:
+            droid = None
+            for direction in range(0, 4):
+                next_position = position + directions[direction]
+                if section_map[next_position] != -2:
+                    continue
+                droid = droid or vm.fork()
+                result = droid.feed([direction + 1]).run_until_output(1)[0]
+                if result == 0:
+                    # The droid didn't move, it can be used to try the next direction
+                    section_map[next_position] = -1
+                    continue
+                section_map[next_position] = result
+                distance_map[next_position] = distance_map[position] + 1
+                if result == 2:
+                    oxygen_system_location = next_position
+                next_frontier.append((next_position, droid))
+                droid = None
+        frontier = next_frontier
+    return section_map, distance_map, oxygen_system_location
+
+def get_distances(section_map, origin):
+    # type: (SectionMap, Point) -> Tuple[SectionMap, int]
+    '''
+    Computes the distance from a position to every open position, and returns them with the largest one.
+
+    The breadth first search visits each position once, the distance map telling which ones are already visited.
+    '''
+    distance_map = Grid(sys.maxsize, 'q')
+    distance_map[origin] = 0
+    distance = 0
+    frontier = [origin]
+    while True:
+        next_frontier = []
+        for position in frontier:
+            for direction in directions:
+                next_position = position + direction
+                if section_map[next_position] >= 0 and distance_map[next_position] == sys.maxsize:
+                    distance_map[next_position] = distance + 1
+                    next_frontier.append(next_position)
+        if not next_frontier:
+            return distance_map, distance
+        distance += 1
+        frontier = next_frontier
+
 def get_fill_time(system_map, oxygen_location):
     # type: (SectionMap, Point) -> int
     '''
     Calculates the time to fill the whole section.
     '''
-    time = -1 # need to start at -1, as time to fill oxygen_location will be counted
-    filled = []
-    new_filled = [oxygen_location]
-    while new_filled:
-        filled.extend(new_filled)
-        time += 1
-        next_filled = []
-        for point in new_filled:
-            next_filled.extend([p for p in [point + directions[i] for i in range(0, 4)] if p not in filled and system_map[p] >= 0])
-        new_filled = next_filled
-    return time
+    return get_distances(system_map, oxygen_location)[1]
+
+def checks_d15p1(program):
+    section_map, oxygen_system_location = build_map(program)
+    explored_map, explored_distances, explored_location = explore_map(program)
+    assert list(explored_map.items()) == list(section_map.items())
+    assert explored_location == oxygen_system_location
+    oxygen_distances, _ = get_distances(section_map, oxygen_system_location)
+    assert explored_distances[oxygen_system_location] == oxygen_distances[Point(0, 0)]
+    assert asyncio.run(follow_wall(AsyncIntcodeVM(IntcodeVM(program))))[2] == oxygen_system_location
 
+def checks_d15p2():
+    section = [
+        ' ##   ',
+        '#..## ',
+        '#.#..#',
+        '#.O.# ',
+        ' ###  '
+    ]
+    section_map = Grid(-2)
+    for y, line in enumerate(section):
+        for x, cell in enumerate(line):
+            section_map[Point(x, y)] = {' ': -2, '#': -1, '.': 1, 'O': 2}[cell]
+    distance_map, fill_time = get_distances(section_map, Point(2, 3))
+    assert fill_time == get_fill_time(section_map, Point(2, 3)) == 4
+    assert distance_map[Point(1, 1)] == 3 and distance_map[Point(0, 0)] == sys.maxsize
 
 def run(with_tests = True):
     with open(os.path.dirname(__file__) + os.sep + 'input.txt', 'r') as in_file:
         program = ast.literal_eval('[' + in_file.read().strip() + ']')
 
-    section_map, distance_map, oxygen_system_location = build_map(program)
-    d15p1 = distance_map[oxygen_system_location]
+    if with_tests: checks_d15p1(program)
+
+    section_map, oxygen_system_location = build_map(program)
+    # The distance from the oxygen system to the start is the one from the start to the oxygen system
+    oxygen_distances, fill_time = get_distances(section_map, oxygen_system_location)
+    d15p1 = oxygen_distances[Point(0, 0)]
     print(f'Day 15, Part 1 : {d15p1}') # 262
 
-    d15p2 = get_fill_time(section_map, oxygen_system_location)
-    print(f'Day 15, Part 2 : {d15p2}') # 15988
+    if with_tests: checks_d15p2()
+
+    d15p2 = fill_time
+    print(f'Day 15, Part 2 : {d15p2}') # 314
 
 if __name__ == '__main__':
     run()
@@ -1,74 +1,95 @@
 import ast
-import functools
 import os
-import sys
 from collections import defaultdict
-from typing import Dict, Tuple, List, Text
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Tuple, List, Text, Iterable, Iterator, Optional
 
-from Day10 import Point
+from Day10 import Point, Grid
 from Day2 import Program
-from Day9 import run_program
+from Day9 import IntcodeVM
 
-ShieldMap = Dict[Point, Tuple[int, int]]
+ShieldMap = Grid
 
 directions = [Point(0, -1), Point(1, 0), Point(0, 1), Point(-1, 0)]
 directions_ascii = list(map(ord, '^>v<'))
 
+def decode_camera(batches):
+    # type: (Iterable[List[int]]) -> Tuple[ShieldMap, Tuple[Point, int]]
+    '''
+    Converts the camera output to a structured map while it is produced, batch by batch.
+
+    Each line is added to a row-major array as soon as it is complete, the robot being looked for in it, so that
+    neither the whole output nor a map of points is kept. The frame ends at the first empty line.
+    '''
+    vacuum_state = (Point(-1, -1), 0)
+    cells = bytearray()
+    width, height = 0, 0
+    line = b''
+    for batch in batches:
+        rows = bytes(batch).split(b'\n')
+        rows[0] = line + rows[0]
+        line = rows.pop()
+        for row in rows:
+            if not row:
+                return Grid.from_cells(cells, width), vacuum_state
+            if height == 0:
+                width = len(row)
+            elif len(row) != width:
+                raise Exception(f'Line {height} of the camera output has {len(row)} cells instead of {width}')
+            for cell in directions_ascii:
+                x = row.find(cell)
+                if x != -1:
+                    vacuum_state = (Point(x, height), cell)
+                    row = row.replace(bytes([cell]), b'#')
+            cells += row
+            height += 1
+    if line:
+        raise Exception('The camera output ends in the middle of a line')
+    return Grid.from_cells(cells, width), vacuum_state
+
 def build_map(cells):
     # type: (List[int]) -> Tuple[ShieldMap, Tuple[Point, int]]
     '''
     Converts the camera output to a structured map
     '''
-    vacuum_state = (Point(-1, -1), 0)
-    shield_map = defaultdict(lambda: 0)
-    x = 0
-    y = 0
-    for cell in cells:
-        if cell == 10:
-            y += 1
-            x = 0
-            continue
-        pos = Point(x, y)
-        if cell in directions_ascii:
-            vacuum_state = (pos, cell)
-            cell = 35
-        shield_map[pos] = cell
-        x += 1
-
-    return shield_map, vacuum_state
+    return decode_camera([cells])
 
 def find_intersections(shield_map):
     # type: (ShieldMap) -> List[Point]
     '''
     Returns the list of intersections in a map
+
+    The scaffold cells are the bits of an integer, so that the cells whose four neighbours are scaffold are found by
+    a few shifts and ands on the whole map. Cells on the left and right edges are excluded, as a shift by 1 moves them
+    to the other side of the adjacent line.
     '''
-    intersections = [ point for point, value in list(shield_map.items()) if value == 35 and len([point + d for d in directions if shield_map[point + d] != 35]) == 0 ]
-    return intersections
+    width, height = shield_map.width, shield_map.height
+    if width < 3:
+        return []
+    scaffold = shield_map.mask(35)
+    inner_columns = int(('0' + '1' * (width - 2) + '0') * height, 2)
+    crossings = scaffold & scaffold >> 1 & scaffold << 1 & scaffold >> width & scaffold << width & inner_columns
+    return list(shield_map.points(crossings))
 
 def display_map(shield_map, vacuum_state=(Point(-1, -1), 0), intersections=[]):
     # type: (ShieldMap, Tuple[Point, int], List[int]) -> None
     '''
     Prints the map in text mode
     '''
-    max_x = max([p.x for p in shield_map if shield_map[p] is not None])
-    max_y = max([p.y for p in shield_map if shield_map[p] is not None])
-
-    for y in range(0, max_y + 1):
-        for x in range(0, max_x + 1):
-            pos = Point(x, y)
-            value = shield_map[Point(x, y)] if pos != vacuum_state[0] else vacuum_state[1]
-            if pos in intersections:
-                value = ord('O')
-            sys.stdout.write(chr(value))
-        print('')
+    shield_map = shield_map.copy()
+    if vacuum_state[1]:
+        shield_map[vacuum_state[0]] = vacuum_state[1]
+    for point in intersections:
+        shield_map[point] = ord('O')
+    print(shield_map.text({0: ' '}))
 
 def sum_alignement_parameters(intersections):
     # type: (List[Point]) -> int
     '''
     Calculates the alignement parameters
     '''
-    res = functools.reduce(int.__add__, map(lambda p: p.x * p.y, intersections))
-    return res
+    return sum(p.x * p.y for p in intersections)
 
 def generate_instructions(system_map, vacuum_state):
     # type: (ShieldMap, Tuple[Point, int]) -> Text
@@ -98,25 +119,147 @@ def generate_instructions(system_map, vacuum_state):
 
     return ','.join(instructions)
 
-def compress_instructions(instructions):
-    # type: (Text) -> Tuple[Text, Dict[Text, Text]]
+def generate_paths(system_map, vacuum_state):
+    # type: (ShieldMap, Tuple[Point, int]) -> Iterator[Text]
+    '''
+    Lazily generates the instructions of the paths going through the whole scaffolding without moving twice along the
+    same segment. At intersections, going straight is tried before turning left, then right, so that the first path is
+    the one of generate_instructions. As in generate_instructions, the robot can start by going straight, with a move
+    without turn tried after turning.
+    '''
+    nb_scaffold = system_map.count(35)
+    visits = defaultdict(int, {vacuum_state[0]: 1})
+    used_segments = set()
+    moves = [] # [turn, steps] pairs
+
+    def get_options(pos, direction_idx):
+        options = []
+        turns = [(None, direction_idx), ('L', (direction_idx - 1) % 4), ('R', (direction_idx + 1) % 4)]
+        if not moves:
+            # There is no move to extend yet, going straight starts one without turn
+            turns = turns[1:] + [('', direction_idx)]
+        for turn, idx in turns:
+            next_pos = pos + directions[idx]
+            if system_map[next_pos] == 35 and frozenset((pos, next_pos)) not in used_segments:
+                options.append((turn, idx))
+        return options
+
+    def advance(pos, direction_idx, turn, undo):
+        # Moves the robot by one step, recording how to undo it, and returns its new position and whether it is new
+        next_pos = pos + directions[direction_idx]
+        segment = frozenset((pos, next_pos))
+        used_segments.add(segment)
+        visits[next_pos] += 1
+        if turn is None:
+            moves[-1][1] += 1
+        else:
+            moves.append([turn, 1])
+        undo.append((segment, next_pos, turn))
+        return next_pos, visits[next_pos] == 1
+
+    def revert(undo):
+        for segment, next_pos, turn in reversed(undo):
+            used_segments.discard(segment)
+            visits[next_pos] -= 1
+            if turn is None:
+                moves[-1][1] -= 1
+            else:
+                moves.pop()
+
+    def explore(pos, direction_idx, nb_visited):
+        # Follows the scaffolding as long as there is a single way to go, then tries each way
+        undo = []
+        while nb_visited < nb_scaffold:
+            options = get_options(pos, direction_idx)
+            if len(options) != 1:
+                for turn, idx in options:
+                    branch_undo = []
+                    next_pos, new = advance(pos, idx, turn, branch_undo)
+                    yield from explore(next_pos, idx, nb_visited + new)
+                    revert(branch_undo)
+                break
+            turn, direction_idx = options[0]
+            pos, new = advance(pos, direction_idx, turn, undo)
+            nb_visited += new
+        else:
+            yield ','.join(f'{turn},{steps}' if turn else str(steps) for turn, steps in moves)
+        revert(undo)
+
+    return explore(vacuum_state[0], directions_ascii.index(vacuum_state[1]), 1)
+
+def compress_instructions(instructions, max_length=20, nb_functions=3):
+    # type: (Text, int, int) -> Optional[Tuple[Text, Dict[Text, Text]]]
     '''
     Calculates the main routine and functions for moving the robot
+
+    Functions are sequences of whole moves (a turn and a number of steps) of at most max_length characters, as is the
+    main routine calling them. The routines chosen are the shortest ones in total, then the ones with the fewest
+    calls. The search tries, at each position in the moves, the functions matching the moves from there and, while
+    there are less than nb_functions, each new function starting there. It is memoised on the position, the functions
+    already defined and the number of calls the main routine can still make. Returns None if the instructions cannot
+    be compressed.
     '''
-    # Didnot manage to implement this properly for now :(
-    return '', {'': ''}
+    tokens = instructions.split(',')
+    moves = tuple(','.join(tokens[i:i + 2]) for i in range(0, len(tokens), 2))
 
+    @lru_cache(maxsize=None)
+    def search(position, functions, calls_left):
+        # Returns the length of the shortest routines covering the moves from position with at most calls_left calls
+        # (each call and each new function counting with its separator), the calls and all the functions, or None
+        if position == len(moves):
+            return 0, (), functions
+        if calls_left == 0:
+            return None
+        candidates = list(enumerate(functions))
+        if len(functions) < nb_functions:
+            for end in range(position + 1, len(moves) + 1):
+                if len(','.join(moves[position:end])) > max_length:
+                    break
+                candidates.append((len(functions), moves[position:end]))
+        best = None
+        for index, function in candidates:
+            end = position + len(function)
+            if moves[position:end] != function:
+                continue
+            if index < len(functions):
+                result, length = search(end, functions, calls_left - 1), 2
+            else:
+                result, length = search(end, functions + (function,), calls_left - 1), 2 + len(','.join(function)) + 1
+            if result is not None:
+                if best is None or (result[0] + length, len(result[1]) + 1) < (best[0], len(best[1])):
+                    best = result[0] + length, (index,) + result[1], result[2]
+        return best
+
+    result = search(0, (), (max_length + 1) // 2)
+    if result is None:
+        return None
+    _, calls, functions = result
+    names = [chr(ord('A') + index) for index in range(nb_functions)]
+    # Unused functions must still be given to the robot
+    functions = [','.join(function) for function in functions]
+    functions += functions[:1] * (nb_functions - len(functions))
+    return ','.join(names[index] for index in calls), dict(zip(names, functions))
+
+def plan_moves(system_map, vacuum_state, max_paths=10000):
+    # type: (ShieldMap, Tuple[Point, int], int) -> Text
+    '''
+    Returns the instructions of the first path through the whole scaffolding, among the max_paths first ones of
+    generate_paths, which can be compressed in movement functions.
+    '''
+    for instructions in islice(generate_paths(system_map, vacuum_state), max_paths):
+        if compress_instructions(instructions) is not None:
+            return instructions
+    raise Exception('No path through the scaffolding fits in the movement functions')
 
 def move_robot(program, instructions):
     # type: (Program, Text) -> int
     '''
     Moves the robot and return the amount of collected dust
     '''
-    main_routine, functions = compress_instructions(instructions)
-
-    # Found by hand...
-    main_routine = "A,B,A,B,A,C,B,C,A,C"
-    functions = {'A': 'L,6,R,12,L,6', 'B': 'R,12,L,10,L,4,L,6', 'C':'L,10,L,10,L,4,L,6'}
+    compressed = compress_instructions(instructions)
+    if compressed is None:
+        raise Exception(f'Instructions cannot be compressed: {instructions}')
+    main_routine, functions = compressed
 
     input = list(map(ord, main_routine))
     input.append(10)
@@ -126,10 +269,10 @@ def move_robot(program, instructions):
     input.append(ord('n'))
     input.append(10)
 
-    program[0] = 2
-    _, output, _, _ = run_program(program, input)
+    vm = IntcodeVM(program, input)
+    vm.memory[0] = 2
 
-    return output[-1]
+    return vm.run_until_input()[-1]
 
 def checks_d17p1():
     cells = [
@@ -144,6 +287,8 @@ def checks_d17p1():
     system_map, _ = build_map(cells)
     intersections = find_intersections(system_map)
     assert sum_alignement_parameters(intersections) == 76
+    batches = [cells[i:i + 10] for i in range(0, len(cells), 10)] + [[10, 35, 10]]
+    assert decode_camera(iter(batches))[0].cells == system_map.cells
 
 def checks_d17p2():
     cells = [
@@ -167,7 +312,21 @@ def checks_d17p2():
     vacuum_state = (Point(0, 6), ord('^'))
     instructions = generate_instructions(system_map, vacuum_state)
     assert instructions == 'R,8,R,8,R,4,R,4,R,8,L,6,L,2,R,4,R,4,R,8,R,8,R,8,L,6,L,2'
-    # assert compress_instructions(instructions)[0] == 'A,B,C,B,A,C'
+    assert compress_instructions(instructions)[0] == 'A,B,C,B,A,C'
+    assert next(generate_paths(system_map, vacuum_state)) == instructions
+    assert compress_instructions(instructions, nb_functions=2) is None
+    assert plan_moves(system_map, vacuum_state) == instructions
+
+    # The shortest routines for the end of the moves use too many calls once the beginning is covered
+    instructions = 'R,2,R,2,L,10,L,10,L,10,L,10,R,2,L,12,R,4,R,2,R,2,L,12,R,4,R,2,L,12,R,4,R,2'
+    main, functions = compress_instructions(instructions)
+    assert len(main) <= 20 and ','.join(functions[name] for name in main.split(',')) == instructions
+
+    # The robot starts by going straight
+    system_map, vacuum_state = build_map(list(map(ord, '..#####\n..#...#\n..#...#\n..^...#\n......#\n')))
+    instructions = generate_instructions(system_map, vacuum_state)
+    assert instructions == '3,R,4,R,4'
+    assert next(generate_paths(system_map, vacuum_state)) == plan_moves(system_map, vacuum_state) == instructions
 
 def run(with_tests = True):
     with open(os.path.dirname(__file__) + os.sep + 'input.txt', 'r') as in_file:
@@ -175,14 +334,13 @@ def run(with_tests = True):
 
     checks_d17p1()
 
-    _, output, _, _ = run_program(program)
-    system_map, vacuum_state = build_map(output)
+    system_map, vacuum_state = decode_camera(IntcodeVM(program).iterate_output())
     d17p1 = sum_alignement_parameters(find_intersections(system_map))
     print(f'Day 17, Part 1 : {d17p1}') # 8928
 
     checks_d17p2()
 
-    instructions = generate_instructions(system_map, vacuum_state)
+    instructions = plan_moves(system_map, vacuum_state)
     d17p2 = move_robot(program, instructions)
     print(f'Day 17, Part 2 : {d17p2}') # 880360
 
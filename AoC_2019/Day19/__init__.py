@@ -1,56 +1,245 @@
 import ast
 import os
 import sys
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from Day10 import Point
-from Day9 import run_program
+from Day2 import Program
+from Day9 import run_program, ResidualProgram
+
+Span = Optional[Tuple[int, int]]
 
 def get_status(x, y, program):
+    if isinstance(program, ResidualProgram):
+        return program.run([x, y])[0] == 1
     _, output, _, _ = run_program(program, [x, y])
     return output[0] == 1
 
-def get_affected_points(program, width=50, height=50):
-    affected_points = set()
-    for y in range(0, height):
-        for x in range(0, width):
-            if get_status(x, y, program):
-                affected_points.add(Point(x, y))
-    return affected_points
-
-def display_beam(affected_points, start_x=0, start_y=0):
-    height = max(p.y for p in affected_points)
-    width = max(p.x for p in affected_points)
+class BeamOracle():
+    '''
+    Tells whether positions are in the tractor beam, remembering the most recent answers and the beam's span on each
+    row.
+    '''
+    def __init__(self, program, cache_size=4096):
+        # type: (Program or ResidualProgram, int) -> None
+        self.program = program
+        self.nb_runs = 0
+        self.spans = {} # type: Dict[int, Span]
+        self.rows = [] # type: List[int]
+        self.get_status = lru_cache(maxsize=cache_size)(self.run_drone)
+
+    def run_drone(self, x, y):
+        # type: (int, int) -> bool
+        self.nb_runs += 1
+        return get_status(x, y, self.program)
+
+    def get_span(self, y):
+        # type: (int) -> Span
+        '''
+        Returns the first and last x in the beam on a row, or None if the beam is not found on this row.
+        '''
+        if y not in self.spans:
+            span = self.find_span(y)
+            self.spans[y] = span
+            insort(self.rows, y)
+        return self.spans[y]
+
+    def get_closest_span(self, y, direction):
+        # type: (int, int) -> Optional[Tuple[int, Tuple[int, int]]]
+        '''
+        Returns the closest known row below (direction -1) or above (direction 1) y where the beam was found, with its
+        span.
+        '''
+        index = bisect_left(self.rows, y) - 1 if direction < 0 else bisect_right(self.rows, y)
+        while 0 <= index < len(self.rows):
+            row = self.rows[index]
+            if self.spans[row] is not None:
+                return row, self.spans[row]
+            index += direction
+        return None
+
+    def find_span(self, y):
+        # type: (int) -> Span
+        '''
+        Finds the span of the beam on a row. Both edges of the beam move right when y grows, so the span is walked from
+        the previous row if it is known, otherwise it is searched between the spans of the closest known rows.
+        '''
+        below = self.get_closest_span(y, -1)
+        if below is not None and below[0] == y - 1:
+            return self.walk_span(y, below[1])
+        if below is None and y > 16:
+            # Find a row to scale from, the first rows are cheaper to scan
+            self.get_span(y // 2)
+            below = self.get_closest_span(y, -1)
+        return self.search_span(y, below, self.get_closest_span(y, 1))
+
+    def walk_span(self, y, previous):
+        # type: (int, Tuple[int, int]) -> Span
+        start, end = previous
+        x = start
+        while not self.get_status(x, y):
+            x += 1
+            if x > max(2 * y, end): # there are some lines without beam at the begining
+                return None
+        start = x
+        x = max(start, end)
+        while self.get_status(x + 1, y):
+            x += 1
+        return start, x
+
+    def search_span(self, y, below, above):
+        # type: (int, Optional[Tuple[int, Tuple[int, int]]], Optional[Tuple[int, Tuple[int, int]]]) -> Span
+        low = below[1][0] if below is not None else 0
+        high = above[1][1] if above is not None else None
+        # The beam comes from the origin, so the middle of a known span scaled to this row should be in the beam
+        x = None
+        reference = below if below is not None and below[0] > 0 else above
+        if reference is not None and reference[0] > 0:
+            row, (start, end) = reference
+            x = max(low, (start + end) * y // (2 * row))
+            x = x if high is None else min(x, high)
+        if x is None or not self.get_status(x, y):
+            limit = high if high is not None else max(2 * y, low)
+            x = next((x for x in range(low, limit + 1) if self.get_status(x, y)), None)
+            if x is None:
+                return None
+            start = x
+        else:
+            start = self.find_edge(y, x, low)
+        if high is None:
+            step = 1
+            while self.get_status(x + step, y):
+                step *= 2
+            high = x + step
+        return start, self.find_edge(y, x, high)
+
+    def find_edge(self, y, inside, outside):
+        # type: (int, int, int) -> int
+        '''
+        Binary searches the last position in the beam going from inside toward outside.
+        '''
+        if self.get_status(outside, y):
+            return outside
+        while abs(outside - inside) > 1:
+            middle = (inside + outside) // 2
+            if self.get_status(middle, y):
+                inside = middle
+            else:
+                outside = middle
+        return inside
+
+def scan_rows(program, width, rows):
+    # type: (Program or ResidualProgram, int, Iterable[int]) -> List[int]
+    '''
+    Returns a bit mask of the positions in the beam for each row, bit x being set if position x is in the beam.
+    '''
+    if not isinstance(program, ResidualProgram):
+        program = ResidualProgram(program)
+    return [sum(1 << x for x in range(0, width) if get_status(x, y, program)) for y in rows]
+
+def get_affected_points(program, width=50, height=50, max_workers=1, chunk_size=16):
+    # type: (Program or ResidualProgram, int, int, int, int) -> List[int]
+    '''
+    Returns the bit masks of the positions in the beam for each row of the area (see scan_rows).
+
+    With max_workers other than 1, the rows are scanned by chunks in a pool of max_workers processes (None meaning one
+    per CPU), each process specializing its own drone program.
+    '''
+    if max_workers == 1:
+        return scan_rows(program, width, range(0, height))
+    if isinstance(program, ResidualProgram):
+        program = program.program
+    chunks = [range(y, min(y + chunk_size, height)) for y in range(0, height, chunk_size)]
+    with ProcessPoolExecutor(max_workers) as executor:
+        return [mask for masks in executor.map(partial(scan_rows, program, width), chunks) for mask in masks]
+
+def count_affected_points(rows):
+    # type: (List[int]) -> int
+    return sum(bin(mask).count('1') for mask in rows)
+
+def display_beam(rows, start_x=0, start_y=0):
+    height = len(rows)
+    width = max(mask.bit_length() for mask in rows)
     for y in range(start_y, height):
         for x in range(start_x, width):
-            sys.stdout.write('#' if Point(x, y) in affected_points else '.')
+            sys.stdout.write('#' if rows[y] >> x & 1 else '.')
         print('')
 
-def find_closest_n_square(program, n=100):
-    beam_starts = {n-1: 0}
-    y = n
-    while True:
-        x = beam_starts[y-1]
-        beam_starts[y] = x
-        while x < 2 * y: # there are some lines without beam at the begining so we limit the number of position to test even if beam is not found
-            if get_status(x, y, program):
-                beam_starts[y] = x
-                # Are other corners of the square in the beam ?
-                if y > n and get_status(x + n - 1, y, program) and get_status(x, y - n + 1, program) and get_status(x + n - 1, y - n + 1, program):
-                    return Point(x, y - n + 1)
-                break
-            x += 1
+def find_closest_n_square(program, n=100, gallop=True):
+    # type: (Program or ResidualProgram or BeamOracle, int, bool) -> Point
+    '''
+    Returns the top left corner of the closest n x n square in the beam. The beam widens and moves right, so a square
+    fits with its bottom left corner on the start of a row if the row n - 1 above reaches its top right corner. This
+    only gets more true further from the origin, so the closest row can be found by galloping then bisecting on y
+    instead of walking every row.
+    '''
+    oracle = program if isinstance(program, BeamOracle) else BeamOracle(program)
+    def get_slack(y):
+        # type: (int) -> Optional[int]
+        bottom, top = oracle.get_span(y), oracle.get_span(y - n + 1)
+        if bottom is None or top is None:
+            return None
+        return top[1] - bottom[0] - n + 1
+
+    def fits(y):
+        # type: (int) -> bool
+        slack = get_slack(y)
+        return slack is not None and slack >= 0
+
+    y = n - 1
+    if gallop and not fits(y):
+        low, y = y, max(2 * y, 1)
+        while not fits(y):
+            low, y = y, 2 * y
+        while y - low > 1:
+            middle = (low + y) // 2
+            if fits(middle):
+                y = middle
+            else:
+                low = middle
+        # Edges are rounded so the slack only grows by trend, keep looking below until the square is clearly too big
+        row = y - 1
+        slack = get_slack(row) if row >= n - 1 else None
+        while slack is not None and slack > -4:
+            if slack >= 0:
+                y = row
+            row -= 1
+            slack = get_slack(row) if row >= n - 1 else None
+    while not fits(y):
         y += 1
+    return Point(oracle.get_span(y)[0], y - n + 1)
+
+def checks_d19p1(program):
+    rows = get_affected_points(program, 20, 30)
+    assert len(rows) == 30 and all(mask < 1 << 20 for mask in rows)
+    assert rows == get_affected_points(program, 20, 30, max_workers=2, chunk_size=7)
+    assert count_affected_points(rows) == sum(get_status(x, y, program) for y in range(0, 30) for x in range(0, 20))
 
+def checks_d19p2(program):
+    # Rounded edges make some rows fit before the bisected one
+    oracle = BeamOracle(program)
+    for n in [13, 20, 100]:
+        assert find_closest_n_square(program, n) == find_closest_n_square(oracle, n, gallop=False)
 
 def run(with_tests = True):
     with open(os.path.dirname(__file__) + os.sep + 'input.txt', 'r') as in_file:
         program = ast.literal_eval('[' + in_file.read().strip() + ']')
 
-    d19p1 = len(get_affected_points(program))
+    # The drone program is run for each position, specializing it once makes each run much cheaper
+    program = ResidualProgram(program)
+
+    if with_tests: checks_d19p1(program)
+
+    d19p1 = count_affected_points(get_affected_points(program))
     print(f'Day 19, Part 1 : {d19p1}') # 226
 
     #display_beam(get_affected_points(program, 30,30), 18, 22)
 
+    if with_tests: checks_d19p2(program)
+
     pos = find_closest_n_square(program, 100)
     d19p2 = pos.x * 10000 + pos.y
     print(f'Day 19, Part 2 : {d19p2}') # 7900946
@@ -1,5 +1,5 @@
 import ast, os
-from typing import List
+from typing import List, Dict, Tuple, Optional
 
 Program = List[int]
 
@@ -23,20 +23,110 @@ def run_program(program):
         raise Exception("Something went wrong")
     return program
 
+Polynomial = Dict[Tuple[int, int], int]
+
+def add_polynomials(a, b):
+    # type: (Polynomial, Polynomial) -> Polynomial
+    '''
+    Adds two polynomials of the noun and verb, stored as {(noun degree, verb degree): coefficient}.
+    '''
+    res = dict(a)
+    for degrees, coefficient in b.items():
+        res[degrees] = res.get(degrees, 0) + coefficient
+        if res[degrees] == 0:
+            del res[degrees]
+    return res
+
+def multiply_polynomials(a, b):
+    # type: (Polynomial, Polynomial) -> Polynomial
+    '''
+    Multiplies two polynomials of the noun and verb.
+    '''
+    res = dict()
+    for (noun_a, verb_a), coefficient_a in a.items():
+        for (noun_b, verb_b), coefficient_b in b.items():
+            res = add_polynomials(res, {(noun_a + noun_b, verb_a + verb_b): coefficient_a * coefficient_b})
+    return res
+
+def get_constant(polynomial):
+    # type: (Polynomial) -> Optional[int]
+    '''
+    Returns the value of a polynomial which doesn't depend on the noun and verb, None otherwise.
+    '''
+    if polynomial is None or any(degrees != (0, 0) for degrees in polynomial):
+        return None
+    return polynomial.get((0, 0), 0)
+
+def fold_program(program):
+    # type: (Program) -> Optional[Polynomial]
+    '''
+    Executes an intcode program with its noun and verb left unknown, and returns its output as a polynomial of them.
+
+    Values read at an address depending on the noun or verb are unknown (None), which is fine as long as they are not
+    used. Returns None when the output is unknown, or when the execution itself depends on the noun or verb.
+    '''
+    memory = [{(0, 0): value} if value else {} for value in program]
+    memory[1] = {(1, 0): 1}
+    memory[2] = {(0, 1): 1}
+    pointer = 0
+    try:
+        while pointer < len(memory):
+            opcode = get_constant(memory[pointer])
+            if opcode == 99:
+                break
+            if opcode not in [1, 2]:
+                return None
+            addresses = [get_constant(memory[pointer + i]) for i in range(1, 4)]
+            if addresses[2] is None:
+                return None
+            param1, param2 = [memory[address] if address is not None else None for address in addresses[:2]]
+            if param1 is None or param2 is None:
+                memory[addresses[2]] = None
+            elif opcode == 1:
+                memory[addresses[2]] = add_polynomials(param1, param2)
+            else:
+                memory[addresses[2]] = multiply_polynomials(param1, param2)
+            pointer += 4
+    except IndexError:
+        return None
+    return memory[0]
+
 def find_noun_verb_for_result(program, result):
     # type: (Program, int) -> int
     '''
     Finds the combination of input required to generate a given output with a given program.
+
+    The program is first folded to a polynomial of the noun and verb, to only run the combinations giving the
+    expected output (solved directly when it is linear). All the combinations are run if the program can't be folded.
     '''
-    for noun in range(0, 100):
-        for verb in range(0, 100):
-            program[1] = noun
-            program[2] = verb
-            try:
-                if run_program(list(program))[0] == result:
-                    return 100 * noun + verb
-            except:
-                pass
+    def check(noun, verb):
+        candidate = list(program)
+        candidate[1] = noun
+        candidate[2] = verb
+        try:
+            return run_program(candidate)[0] == result
+        except Exception: # The program is invalid with these parameters
+            return False
+
+    polynomial = fold_program(program)
+    if polynomial is None:
+        candidates = ((noun, verb) for noun in range(0, 100) for verb in range(0, 100))
+    elif set(polynomial) <= {(0, 0), (1, 0), (0, 1)}:
+        def solve(noun):
+            remainder = result - polynomial.get((0, 0), 0) - polynomial.get((1, 0), 0) * noun
+            if (0, 1) not in polynomial:
+                return range(0, 100) if remainder == 0 else []
+            verb, rest = divmod(remainder, polynomial[(0, 1)])
+            return [verb] if rest == 0 and 0 <= verb < 100 else []
+        candidates = ((noun, verb) for noun in range(0, 100) for verb in solve(noun))
+    else:
+        candidates = ((noun, verb) for noun in range(0, 100) for verb in range(0, 100)
+                      if sum(coefficient * noun ** noun_degree * verb ** verb_degree
+                             for (noun_degree, verb_degree), coefficient in polynomial.items()) == result)
+
+    for noun, verb in candidates:
+        if check(noun, verb):
+            return 100 * noun + verb
     raise Exception('No parameters for this result')
 
 def checks_d2p1(intcode_computer):
@@ -57,6 +147,13 @@ def checks_d2p1(intcode_computer):
     for prog, result in zip(progs, results):
         assert intcode_computer(prog) == result
 
+def checks_d2p2():
+    assert fold_program([1, 0, 0, 0, 1, 1, 2, 0, 99]) == {(1, 0): 1, (0, 1): 1}
+    assert find_noun_verb_for_result([1, 0, 0, 0, 1, 1, 2, 0, 99], 10) == 208
+    assert fold_program([2, 0, 0, 0, 2, 1, 2, 0, 99]) == {(1, 1): 1}
+    assert find_noun_verb_for_result([2, 0, 0, 0, 2, 1, 2, 0, 99], 12) == 206
+    assert fold_program([1, 0, 0, 0, 1, 0, 2, 0, 99]) is None
+
 def run(with_tests = True):
     with open(os.path.dirname(__file__) + os.sep + 'input.txt', 'r') as in_file:
         program = ast.literal_eval('[' + in_file.read().strip() + ']')
@@ -68,6 +165,8 @@ def run(with_tests = True):
     d2p1 = run_program(list(program))[0]
     print(f'Day 2, Part 1 : {d2p1}')  # 9581917
 
+    if with_tests: checks_d2p2()
+
     d2p2 = find_noun_verb_for_result(program, 19690720)
     print(f'Day 2, Part 2 : {d2p2}')  # 2505
 
@@ -1,4 +1,5 @@
 import ast, os
+from collections import deque
 from typing import List, Tuple
 
 from Day2 import checks_d2p1, Program
@@ -6,12 +7,13 @@ from Day2 import checks_d2p1, Program
 Input = List[int]
 Output = List[int]
 
-def run_program(program, return_output = False, input_list=list()):
+def run_program(program, return_output = False, input_list=()):
     # type: (Program, bool, Input) -> Tuple[Program, Output] or Program
     '''
     Executes an intcode program.
     '''
     program = list(program)
+    input_list = deque(input_list)
 
     def halt(message):
         print(f'Program: {program}')
@@ -66,7 +68,7 @@ def run_program(program, return_output = False, input_list=list()):
             value = None
             while not isinstance(value, int):
                 try:
-                    value = input_list.pop(0) if input_list else int(input('Enter int value: '))
+                    value = input_list.popleft() if input_list else int(input('Enter int value: '))
                 except ValueError:
                     pass
             write_result(instruction_pointer + 1, value)
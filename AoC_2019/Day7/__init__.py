@@ -1,12 +1,16 @@
 import ast, os
-from typing import Tuple, List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, permutations
+from typing import Tuple, List, Callable, Iterable, Iterator, Optional
 
 from Day2 import checks_d2p1, Program
 from Day5 import checks_d5p2, Input, Output
+from Day9 import IntcodeVM, IntcodeNetwork
 
 Phases = List[int]
 
-def run_program(program, return_output = False, input_list=[], instruction_pointer=0, pause_on_input=False):
+def run_program(program, return_output = False, input_list=(), instruction_pointer=0, pause_on_input=False):
     # type: (Program, bool, Input, int, bool) -> Tuple[Program, Output, int] or Tuple[Program, Output] or Program
     '''
     Executes an intcode program.
@@ -15,6 +19,7 @@ def run_program(program, return_output = False, input_list=[], instruction_point
     restart the program from where it was left when the new input is available. This avoids handling threads...
     '''
     program = list(program)
+    input_list = deque(input_list)
 
     def halt(message):
         print(f'Program: {program}')
@@ -70,7 +75,7 @@ def run_program(program, return_output = False, input_list=[], instruction_point
                 try:
                     if not input_list and pause_on_input:
                         return program, output, instruction_pointer
-                    value = input_list.pop(0) if input_list else int(input('Enter int value: '))
+                    value = input_list.popleft() if input_list else int(input('Enter int value: '))
                 except ValueError:
                     pass
             write_result(instruction_pointer + 1, value)
@@ -104,77 +109,176 @@ def run_amp_chain(program, phases):
     return value
 
 
+def iterate_phases(nb_amp, phase_values, prune=None):
+    # type: (int, Phases, Optional[Callable[[Phases], bool]]) -> Iterator[Phases]
+    '''
+    Lazily generates all the allowed phases combinations, ordered as the phase values.
+
+    When given, prune is called with each partial combination, and all the combinations starting with a partial
+    combination for which it returns True are skipped.
+    '''
+    phase_values = list(dict.fromkeys(phase_values))
+    if (len(phase_values) < nb_amp):
+        raise Exception('There must be at least one phase value per amp')
+    if prune is None:
+        return map(list, permutations(phase_values, nb_amp))
+
+    def explore(phases):
+        for phase in phase_values:
+            if phase in phases or prune(phases + [phase]):
+                continue
+            if len(phases) + 1 == nb_amp:
+                yield phases + [phase]
+            else:
+                yield from explore(phases + [phase])
+
+    return explore([]) if nb_amp else iter([[]])
+
+
 def generate_phases(nb_amp, phase_values):
     # type: (int, Phases) -> List[Phases]
     '''
     Computes all the allowed phases combinations.
     '''
-    if nb_amp == 0:
-        return [[]]
-    res = []
-    phase_values = set(phase_values)
-    if (len(phase_values) < nb_amp):
-        raise Exception('There must be at least one phase value per amp')
-    for phase in phase_values:
-        remaining_phases = set(phase_values)
-        remaining_phases.remove(phase)
-        for phases in generate_phases(nb_amp - 1, list(remaining_phases)):
-            res.append([phase] + phases)
-    return res
+    return list(iterate_phases(nb_amp, phase_values))
 
 
-def find_best_phases(program, nb_amp=5, phase_values=[0, 1, 2, 3, 4]):
-    # type: (Program, int, Phases) -> Tuple[Phases, int]
+def run_amps_loop(amps, value):
+    # type: (List[IntcodeVM], int) -> int
     '''
-    Finds the phases combination giving the higher output.
+    Completes the retroaction loop of an amp chain whose amps already received their phase and first signal.
+
+    The amps are forked first, so that the given ones can be shared with other chains.
+    '''
+    network = IntcodeNetwork()
+    indexes = [network.add(amp.fork()) for amp in amps]
+    for source, target in zip(indexes, indexes[1:] + indexes[:1]):
+        network.connect(source, target)
+    signals = network.watch(indexes[-1])
+    network.send(indexes[0], [value])
+    network.run()
+    return signals[-1] if signals else value
+
+
+def run_amp_tree(program, nb_amp, phase_values, loop=False, prune=None):
+    # type: (Program, int, Phases, bool, Optional[Callable[[Phases], bool]]) -> Iterator[Tuple[Phases, int]]
+    '''
+    Computes the output signal of the phases combinations generated by iterate_phases, in the same order.
+
+    The combinations are explored as a tree, so that the amps of a common prefix run only once. Amps are started once
+    per phase value and forked when they receive their first signal.
+    '''
+    phase_values = list(dict.fromkeys(phase_values))
+    if (len(phase_values) < nb_amp):
+        raise Exception('There must be at least one phase value per amp')
+    started_amps = {}
+
+    def start_amp(phase):
+        if phase not in started_amps:
+            started_amps[phase] = IntcodeVM(program, [phase])
+            started_amps[phase].run_until_input()
+        return started_amps[phase].fork()
+
+    def explore(phases, amps, value):
+        if len(phases) == nb_amp:
+            yield phases, run_amps_loop(amps, value) if loop else value
+            return
+        for phase in phase_values:
+            if phase in phases or (prune is not None and prune(phases + [phase])):
+                continue
+            amp = start_amp(phase)
+            output = amp.feed([value]).run_until_input()
+            yield from explore(phases + [phase], amps + [amp], output.pop() if output else value)
+
+    return explore([], [], 0)
+
+
+def pick_best_phases(results):
+    # type: (Iterable[Tuple[Phases, int]]) -> Tuple[Phases, int]
+    '''
+    Returns the first phases combination giving the higher output.
     '''
     best_phases = None
     best_result = 0
-    for phases in generate_phases(nb_amp, phase_values):
-        result = run_amp_chain(program, phases)
+    for phases, result in results:
         if result > best_result:
             best_phases = phases
             best_result = result
     return best_phases, best_result
 
 
+def find_best_phases_in(program, nb_amp, phase_values, loop, phases_list):
+    # type: (Program, int, Phases, bool, List[Phases]) -> Tuple[Phases, int]
+    '''
+    Finds, in a list of phases combinations ordered as in iterate_phases, the first one giving the higher output. The
+    combinations are explored as a tree by run_amp_tree, pruning the partial combinations which aren't in the list.
+    '''
+    prefixes = {tuple(phases[:length]) for phases in phases_list for length in range(1, nb_amp + 1)}
+    return pick_best_phases(run_amp_tree(program, nb_amp, phase_values, loop,
+                                         lambda phases: tuple(phases) not in prefixes))
+
+
+def search_best_phases(program, nb_amp, phase_values, loop=False, prune=None, max_workers=None):
+    # type: (Program, int, Phases, bool, Optional[Callable[[Phases], bool]], int) -> Tuple[Phases, int]
+    '''
+    Finds the phases combination giving the higher output, skipping the combinations pruned as in iterate_phases, using
+    a pool of max_workers processes (None meaning one per CPU).
+
+    The combinations are split by their first phase in shards searched in parallel by find_best_phases_in, so that the
+    workers share the amps of common prefixes like a serial search, only a few shards per process being pending at any
+    time. The prune function is only called in the main process, so it does not need to be picklable. The shards
+    results are reduced in order, so that ties are resolved as in a serial search, in favour of the first combination.
+    '''
+    shards = groupby(iterate_phases(nb_amp, phase_values, prune), lambda phases: phases[:1])
+    max_pending = 2 * (max_workers or os.cpu_count() or 1)
+    best = (None, 0)
+    with ProcessPoolExecutor(max_workers) as executor:
+        pending = deque()
+        while True:
+            shard = list(next(shards, (None, []))[1])
+            if shard:
+                pending.append(executor.submit(find_best_phases_in, program, nb_amp, phase_values, loop, shard))
+            if pending and (len(pending) >= max_pending or not shard):
+                best = pick_best_phases([best, pending.popleft().result()])
+            elif not shard:
+                return best
+
+
+def find_best_phases(program, nb_amp=5, phase_values=[0, 1, 2, 3, 4], max_workers=1, prune=None):
+    # type: (Program, int, Phases, int, Optional[Callable[[Phases], bool]]) -> Tuple[Phases, int]
+    '''
+    Finds the phases combination giving the higher output, skipping the combinations pruned as in iterate_phases.
+
+    With max_workers set to 1, the combinations are searched by run_amp_tree. Otherwise, they are searched by a pool of
+    max_workers processes (see search_best_phases).
+    '''
+    if max_workers == 1:
+        return pick_best_phases(run_amp_tree(program, nb_amp, phase_values, prune=prune))
+    return search_best_phases(program, nb_amp, phase_values, False, prune, max_workers)
+
+
 def run_amp_chain_loop(program, phases):
     # type: (Program, Phases) -> int
     '''
     Computes the output signal of a amp chain with retroaction loop.
+
+    The amps are connected in a loop by an IntcodeNetwork, which runs each of them only when it has a signal to read.
     '''
-    value = 0
-    programs = [program for i in range(0, len(phases))]
-    pointers = [0 for i in range(0, len(phases))]
-    first_loop = True
-    while True:
-        for i in range(0, len(phases)):
-            if pointers[i] == -1:
-                return value
-            if first_loop:
-                params = [phases[i], value]
-            else:
-                params = [value]
-            res = run_program(programs[i], True, params, pointers[i], True)
-            programs[i], output, pointers[i] = res
-            if output:
-                value = output.pop()
-        first_loop = False
+    return run_amps_loop([IntcodeVM(program, [phase]) for phase in phases], 0)
 
 
-def find_best_phases_loop(program, nb_amp=5, phase_values=[5, 6, 7, 8, 9]):
-    # type: (Program, int, Phases) -> Tuple[Phases, int]
+def find_best_phases_loop(program, nb_amp=5, phase_values=[5, 6, 7, 8, 9], max_workers=1, prune=None):
+    # type: (Program, int, Phases, int, Optional[Callable[[Phases], bool]]) -> Tuple[Phases, int]
     '''
-    Finds the phases combination giving the higher output for an amp chain with retroaction.
+    Finds the phases combination giving the higher output for an amp chain with retroaction, skipping the combinations
+    pruned as in iterate_phases.
+
+    With max_workers set to 1, the combinations are searched by run_amp_tree. Otherwise, they are searched by a pool of
+    max_workers processes (see search_best_phases).
     '''
-    best_phases = None
-    best_result = 0
-    for phases in generate_phases(nb_amp, phase_values):
-        result = run_amp_chain_loop(program, phases)
-        if result > best_result:
-            best_phases = phases
-            best_result = result
-    return best_phases, best_result
+    if max_workers == 1:
+        return pick_best_phases(run_amp_tree(program, nb_amp, phase_values, True, prune))
+    return search_best_phases(program, nb_amp, phase_values, True, prune, max_workers)
 
 def checks_d7p1():
     progs = [
@@ -196,6 +300,17 @@ def checks_d7p1():
     for prog, phases, results in zip(progs, best_phases, results):
         assert run_amp_chain(prog, phases) == results
         assert find_best_phases(prog)[0] == phases
+    assert find_best_phases(progs[2], max_workers=2) == find_best_phases(progs[2])
+
+    assert list(iterate_phases(3, [0, 1, 2], lambda phases: phases[0] == 1)) == [
+        [0, 1, 2],
+        [0, 2, 1],
+        [2, 0, 1],
+        [2, 1, 0]
+    ]
+    no_4_first = lambda phases: phases[0] == 4
+    assert find_best_phases(progs[0], prune=no_4_first) == ([3, 4, 2, 1, 0], 34210)
+    assert find_best_phases(progs[0], prune=no_4_first, max_workers=2) == ([3, 4, 2, 1, 0], 34210)
 
 def checks_d7p2():
     progs = [
@@ -216,6 +331,10 @@ def checks_d7p2():
     for prog, phases, results in zip(progs, best_phases, results):
         assert run_amp_chain_loop(prog, phases) == results
         assert find_best_phases_loop(prog)[0] == phases
+    assert find_best_phases_loop(progs[1], max_workers=2) == find_best_phases_loop(progs[1])
+    # Without the loop, the amps wait for more signals, in both searches
+    assert find_best_phases(progs[0], 5, [5, 6, 7, 8, 9], max_workers=2) == \
+           find_best_phases(progs[0], 5, [5, 6, 7, 8, 9]) == ([9, 8, 7, 6, 5], 129)
 
 def run(with_tests = True):
     with open(os.path.dirname(__file__) + os.sep + 'input.txt', 'r') as in_file:
@@ -1,120 +1,1236 @@
-import ast, os
-from collections import defaultdict
-from typing import Tuple, Dict
+import ast, asyncio, io, os
+from array import array
+from collections import defaultdict, namedtuple, deque
+from contextlib import redirect_stdout
+from functools import partial, lru_cache
+from itertools import repeat
+from math import inf
+from time import perf_counter
+from typing import Tuple, Dict, Callable, Iterable, Iterator, Optional, List, Text
 
 from Day2 import Program, checks_d2p1
 from Day5 import Input, Output, checks_d5p2
 
 NewProgram = Dict[int, int]
 
-def run_program(program, input_list=[], instruction_pointer=0, pause_on_input=False, relative_base = 0):
+DecodedInstruction = Tuple[int, int, int, int, int, int, int, float]
+CompiledBlock = namedtuple('CompiledBlock', ('statements', 'targets', 'end'))
+
+# Number of memory cells used by each instruction, including the instruction itself
+instruction_sizes = {1: 4, 2: 4, 3: 2, 4: 2, 5: 3, 6: 3, 7: 4, 8: 4, 9: 2, 99: 1}
+# Parameters which are written to, and must therefore be in position or relative mode
+written_params = {1: 3, 2: 3, 3: 1, 7: 3, 8: 3}
+# Maximum number of instructions translated in a single compiled block
+max_block_length = 200
+# Maximum number of blocks in the functions generated for the blocks compiled together, so that only small
+# functions are generated again when the program modifies itself
+function_blocks = 16
+# Number of runs of the functions of a compiled program without compiling a block, after which they are merged
+merge_runs = 100
+# Addresses at least this far beyond the end of an ArrayMemory are stored in its sparse part
+sparse_distance = 1 << 16
+
+class ArrayMemory():
+    '''
+    Intcode memory stored in a contiguous array of 64 bits integers.
+
+    The array grows on demand when writing past its end, at least doubling its size so that a growing stack does not
+    grow it at each write, while addresses far beyond its end are kept in a small sparse dictionary. The array is
+    converted to a list of Python integers as soon as a value does not fit in 64 bits.
+    '''
+    def __init__(self, program=()):
+        # type: (NewProgram or Program or ArrayMemory) -> None
+        self.sparse = dict()
+        if isinstance(program, ArrayMemory):
+            self.cells = program.cells[:]
+            self.sparse.update(program.sparse)
+            return
+        if isinstance(program, dict):
+            size = max(program, default=-1) + 1
+            values = [0] * min(size, sparse_distance)
+            for address, value in program.items():
+                if address < len(values):
+                    values[address] = value
+                elif value != 0:
+                    self.sparse[address] = value
+            program = values
+        try:
+            self.cells = array('q', program)
+        except OverflowError:
+            self.cells = list(program)
+
+    def __getitem__(self, address):
+        # type: (int) -> int
+        if address < 0:
+            raise Exception(f'Negative address: {address}')
+        if address < len(self.cells):
+            return self.cells[address]
+        return self.sparse.get(address, 0)
+
+    def __setitem__(self, address, value):
+        # type: (int, int) -> None
+        if address < 0:
+            raise Exception(f'Negative address: {address}')
+        size = len(self.cells)
+        if address >= size:
+            if address >= size + sparse_distance:
+                self.sparse[address] = value
+                return
+            self.cells.extend(repeat(0, max(address + 1 - size, size)))
+            for sparse_address in [a for a in self.sparse if a < len(self.cells)]:
+                self.store(sparse_address, self.sparse.pop(sparse_address))
+        self.store(address, value)
+
+    def store(self, address, value):
+        # type: (int, int) -> None
+        '''
+        Writes a value in the contiguous part of the memory, converting it to a list if the value does not fit.
+        '''
+        try:
+            self.cells[address] = value
+        except OverflowError:
+            self.cells = list(self.cells)
+            self.cells[address] = value
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.cells)
+
+    def copy(self):
+        # type: () -> ArrayMemory
+        return ArrayMemory(self)
+
+    def values(self):
+        # type: () -> Program
+        '''
+        Values of the contiguous part of the memory, as an old program (list). Growing the memory may have added
+        zeros at its end.
+        '''
+        return list(self.cells)
+
+class InputChannel():
+    '''
+    Source of the values read by the input instruction.
+
+    Values given when creating the channel or fed later are queued and read first, in order. Once the queue is empty,
+    values are requested to the callback, if any. A channel without value available returns None, so that the program
+    can be paused until new values are fed.
+    '''
+    def __init__(self, values=(), callback=None):
+        # type: (Iterable[int], Optional[Callable[[], Optional[int]]]) -> None
+        self.queue = deque(values)
+        self.callback = callback
+
+    @classmethod
+    def from_iterator(cls, iterator):
+        # type: (Iterator[int]) -> InputChannel
+        '''
+        Creates a channel lazily reading its values from an iterator.
+        '''
+        return cls(callback=lambda: next(iterator, None))
+
+    def feed(self, values):
+        # type: (Iterable[int]) -> None
+        '''
+        Adds values at the end of the queue.
+        '''
+        self.queue.extend(values)
+
+    def read(self):
+        # type: () -> Optional[int]
+        '''
+        Returns the next input value, or None if there is none available for now.
+        '''
+        if self.queue:
+            return self.queue.popleft()
+        if self.callback is not None:
+            return self.callback()
+        return None
+
+class DecodedProgram():
+    '''
+    Table of the decoded instructions of a program, and of the memory cells they were decoded from. The instructions
+    executed by the engines using the table are counted in nb_instructions.
+    '''
+    def __init__(self):
+        # type: () -> None
+        self.instructions = dict() # type: Dict[int, DecodedInstruction]
+        self.code_cells = set()
+        self.nb_instructions = 0
+
+    def copy(self):
+        # type: () -> DecodedProgram
+        decoded = DecodedProgram()
+        decoded.instructions.update(self.instructions)
+        decoded.code_cells.update(self.code_cells)
+        decoded.nb_instructions = self.nb_instructions
+        return decoded
+
+def decode_program():
+    # type: () -> DecodedProgram
+    '''
+    Creates an empty decoded instructions table.
+
+    Instructions are decoded only once, the first time they are reached, as code and data are mixed in the memory.
+    The table keeps track of the memory cells holding decoded instructions, so that they are decoded again if the
+    program modifies itself.
+    '''
+    return DecodedProgram()
+
+@lru_cache(maxsize=None)
+def decode_format(value):
+    # type: (int) -> Tuple[int, int, int, int, int]
+    '''
+    Decodes the opcode, parameter modes and size of an instruction from its first value, checking they are valid.
+    '''
+    opcode = value % 100
+    if opcode not in instruction_sizes:
+        raise Exception(f'Unknown opcode: {opcode}')
+    size = instruction_sizes[opcode]
+    modes = [value // 100 % 10, value // 1000 % 10, value // 10000 % 10]
+    for param_number in range(1, size):
+        if modes[param_number - 1] not in [0, 1, 2]:
+            raise Exception(f'Unknown parameter mode: {modes[param_number - 1]}')
+    if opcode in written_params and modes[written_params[opcode] - 1] == 1:
+        raise Exception(f'Parameter {written_params[opcode]} must be in position or relative mode')
+    return opcode, modes[0], modes[1], modes[2], size
+
+def decode_instruction(memory, decoded, pointer):
+    # type: (NewProgram or ArrayMemory, DecodedProgram, int) -> DecodedInstruction
+    '''
+    Decodes the instruction at a given address and stores it in the decoded instructions table.
+
+    The instruction is stored as its opcode, the mode and value of its three parameters (0 for missing parameters) and
+    the lowest relative base for which none of its addresses is negative (infinite when a parameter in position mode
+    is negative).
+    '''
+    try:
+        opcode, mode1, mode2, mode3, size = decode_format(memory[pointer])
+    except Exception:
+        print(f'Pointer: {pointer}')
+        raise
+
+    args = [memory[pointer + index] for index in range(1, size)]
+    lowest_base = -inf
+    for mode, arg in zip([mode1, mode2, mode3], args):
+        if mode == 2:
+            lowest_base = max(lowest_base, -arg)
+        elif mode == 0 and arg < 0:
+            lowest_base = inf
+    args += [0] * (4 - size)
+    instruction = (opcode, mode1, args[0], mode2, args[1], mode3, args[2], lowest_base)
+    decoded.instructions[pointer] = instruction
+    decoded.code_cells.update(range(pointer, pointer + size))
+    return instruction
+
+def invalidate_instructions(decoded, address):
+    # type: (DecodedProgram, int) -> None
+    '''
+    Removes from the decoded instructions table all the instructions using a memory cell that has been overwritten.
+    '''
+    for pointer in range(address - 3, address + 1):
+        instruction = decoded.instructions.get(pointer)
+        if instruction is not None and pointer + instruction_sizes[instruction[0]] > address:
+            del decoded.instructions[pointer]
+    decoded.code_cells.discard(address)
+
+def execute_instruction(memory, decoded, instruction, pointer, relative_base, output):
+    # type: (NewProgram or ArrayMemory, DecodedProgram, DecodedInstruction, int, int, Output) -> Tuple[int, int]
+    '''
+    Executes a single instruction through the memory's generic accessors.
+
+    This is the slow path of execute, used when an instruction reaches memory cells that are not in the memory's
+    contiguous storage (cells past its end or in its sparse part, values not fitting in the storage, ...). The
+    instruction must not be an input or halt instruction. Returns the new instruction pointer and relative base.
+    '''
+    opcode, mode1, arg1, mode2, arg2, mode3, arg3, _ = instruction
+
+    def read(mode, arg):
+        return arg if mode == 1 else memory[arg if mode == 0 else relative_base + arg]
+
+    if opcode in [1, 2, 7, 8]:
+        param1, param2 = read(mode1, arg1), read(mode2, arg2)
+        address = arg3 if mode3 == 0 else relative_base + arg3
+        memory[address] = {1: lambda: param1 + param2, 2: lambda: param1 * param2,
+                           7: lambda: 1 if param1 < param2 else 0, 8: lambda: 1 if param1 == param2 else 0}[opcode]()
+        if address in decoded.code_cells:
+            invalidate_instructions(decoded, address)
+        return pointer + 4, relative_base
+    if opcode in [5, 6]:
+        if (read(mode1, arg1) != 0) == (opcode == 5):
+            return read(mode2, arg2), relative_base
+        return pointer + 3, relative_base
+    if opcode == 4:
+        output.append(read(mode1, arg1))
+        return pointer + 2, relative_base
+    if opcode == 9:
+        return pointer + 2, relative_base + read(mode1, arg1)
+    raise Exception(f'Opcode {opcode} can not be executed on its own')
+
+def execute(memory, decoded, input_channel, instruction_pointer, pause_on_input, relative_base, output,
+            output_limit=None):
+    # type: (NewProgram or ArrayMemory, DecodedProgram, InputChannel, int, bool, int, Output, int) -> Tuple[int, int]
+    '''
+    Executes an intcode program, dispatching through its decoded instructions table.
+
+    The memory is updated in place and the program's outputs are appended to output. The execution stops when the
+    program ends, when it waits for input and pause_on_input is set, or when output contains output_limit values.
+    Returns the instruction pointer, which is -1 when the program has ended, and the relative base. The instructions
+    executed are counted in the decoded instructions table.
+
+    Memory backends exposing a contiguous storage as their cells attribute are accessed directly, falling back to
+    their generic accessors only when the storage raises an IndexError or an OverflowError, or when an instruction
+    uses a negative address, which would wrap around the storage. Other mappings, such as the dictionaries returned
+    by convert_program, are accessed directly as well.
+    '''
+    instructions, code_cells = decoded.instructions, decoded.code_cells
+    read_input = input_channel.read
+    pointer = instruction_pointer
+    nb_instructions = 0
+    try:
+        while True:
+            cells = getattr(memory, 'cells', memory)
+            try:
+                while True:
+                    try:
+                        opcode, mode1, arg1, mode2, arg2, mode3, arg3, lowest_base = instruction = instructions[pointer]
+                    except KeyError:
+                        opcode, mode1, arg1, mode2, arg2, mode3, arg3, lowest_base = instruction = \
+                            decode_instruction(memory, decoded, pointer)
+                    nb_instructions += 1
+                    if relative_base < lowest_base and opcode != 3:
+                        raise IndexError # Negative addresses are rejected by the slow path
+
+                    if opcode == 9:
+                        relative_base += arg1 if mode1 == 1 else cells[arg1 if mode1 == 0 else relative_base + arg1]
+                        pointer += 2
+
+                    elif opcode == 1:
+                        param1 = arg1 if mode1 == 1 else cells[arg1 if mode1 == 0 else relative_base + arg1]
+                        param2 = arg2 if mode2 == 1 else cells[arg2 if mode2 == 0 else relative_base + arg2]
+                        address = arg3 if mode3 == 0 else relative_base + arg3
+                        cells[address] = param1 + param2
+                        if address in code_cells:
+                            invalidate_instructions(decoded, address)
+                        pointer += 4
+
+                    elif opcode == 5:
+                        if (arg1 if mode1 == 1 else cells[arg1 if mode1 == 0 else relative_base + arg1]) != 0:
+                            pointer = arg2 if mode2 == 1 else cells[arg2 if mode2 == 0 else relative_base + arg2]
+                        else:
+                            pointer += 3
+
+                    elif opcode == 6:
+                        if (arg1 if mode1 == 1 else cells[arg1 if mode1 == 0 else relative_base + arg1]) == 0:
+                            pointer = arg2 if mode2 == 1 else cells[arg2 if mode2 == 0 else relative_base + arg2]
+                        else:
+                            pointer += 3
+
+                    elif opcode == 2:
+                        param1 = arg1 if mode1 == 1 else cells[arg1 if mode1 == 0 else relative_base + arg1]
+                        param2 = arg2 if mode2 == 1 else cells[arg2 if mode2 == 0 else relative_base + arg2]
+                        address = arg3 if mode3 == 0 else relative_base + arg3
+                        cells[address] = param1 * param2
+                        if address in code_cells:
+                            invalidate_instructions(decoded, address)
+                        pointer += 4
+
+                    elif opcode == 7:
+                        param1 = arg1 if mode1 == 1 else cells[arg1 if mode1 == 0 else relative_base + arg1]
+                        param2 = arg2 if mode2 == 1 else cells[arg2 if mode2 == 0 else relative_base + arg2]
+                        address = arg3 if mode3 == 0 else relative_base + arg3
+                        cells[address] = 1 if param1 < param2 else 0
+                        if address in code_cells:
+                            invalidate_instructions(decoded, address)
+                        pointer += 4
+
+                    elif opcode == 8:
+                        param1 = arg1 if mode1 == 1 else cells[arg1 if mode1 == 0 else relative_base + arg1]
+                        param2 = arg2 if mode2 == 1 else cells[arg2 if mode2 == 0 else relative_base + arg2]
+                        address = arg3 if mode3 == 0 else relative_base + arg3
+                        cells[address] = 1 if param1 == param2 else 0
+                        if address in code_cells:
+                            invalidate_instructions(decoded, address)
+                        pointer += 4
+
+                    elif opcode == 4:
+                        output.append(arg1 if mode1 == 1 else cells[arg1 if mode1 == 0 else relative_base + arg1])
+                        pointer += 2
+                        if len(output) == output_limit:
+                            return pointer, relative_base
+
+                    elif opcode == 3:
+                        value = read_input()
+                        if value is None and pause_on_input:
+                            nb_instructions -= 1 # Counted when resumed
+                            return pointer, relative_base
+                        while not isinstance(value, int):
+                            try:
+                                value = int(input('Enter int value: '))
+                            except ValueError:
+                                pass
+                        address = arg1 if mode1 == 0 else relative_base + arg1
+                        memory[address] = value
+                        cells = getattr(memory, 'cells', memory)
+                        if address in code_cells:
+                            invalidate_instructions(decoded, address)
+                        pointer += 2
+
+                    else: # 99, other opcodes are rejected when decoding
+                        return -1, relative_base
+
+            except (IndexError, OverflowError):
+                pointer, relative_base = execute_instruction(memory, decoded, instruction, pointer, relative_base,
+                                                             output)
+                if len(output) == output_limit:
+                    return pointer, relative_base
+    finally:
+        decoded.nb_instructions += nb_instructions
+
+class CompiledProgram():
+    '''
+    Table of the blocks of a program compiled to Python, and of the functions executing them.
+
+    Like the decoded instructions table, blocks are compiled the first time they are reached (along with the blocks
+    statically reachable from them) and the memory cells they were compiled from are tracked, so that they are removed
+    if the program modifies itself. Code cells which have been overwritten are tracked too: instructions using them are
+    compiled to read them from the memory, or interpreted, instead of being compiled again each time they change.
+
+    Blocks compiled together are executed by common functions, until the functions are merged into a single one for
+    all the blocks. Writes to constant addresses which were not code cells when generating the functions are listed in
+    unchecked_cells, so that the functions are generated again if they become code cells.
+    '''
+    def __init__(self):
+        # type: () -> None
+        self.blocks = dict() # type: Dict[int, CompiledBlock]
+        self.code_cells = set()
+        self.modified_cells = set()
+        self.functions = dict() # type: Dict[int, Callable]
+        self.unchecked_cells = set()
+        self.nb_functions = 0
+        self.nb_runs = 0 # Number of runs of the functions since a block has been compiled
+        self.nb_instructions = 0 # Number of instructions executed by the engine
+
+    def copy(self):
+        # type: () -> CompiledProgram
+        compiled = CompiledProgram()
+        compiled.blocks.update(self.blocks)
+        compiled.code_cells.update(self.code_cells)
+        compiled.modified_cells.update(self.modified_cells)
+        compiled.functions.update(self.functions)
+        compiled.unchecked_cells.update(self.unchecked_cells)
+        compiled.nb_functions = self.nb_functions
+        compiled.nb_runs = self.nb_runs
+        compiled.nb_instructions = self.nb_instructions
+        return compiled
+
+def compile_program():
+    # type: () -> CompiledProgram
+    '''
+    Creates an empty compiled blocks table.
+    '''
+    return CompiledProgram()
+
+def compile_block(memory, compiled, pointer):
+    # type: (NewProgram or ArrayMemory, CompiledProgram, int) -> Optional[CompiledBlock]
+    '''
+    Translates the instructions starting at a given address to Python statements, and stores them in the compiled
+    blocks table. Returns None if the instruction at this address has been overwritten and must be interpreted.
+
+    The block is straight-line code, going through conditional jumps when they are not taken, and ends on a taken jump,
+    an output, the end of the program, before an input instruction (input instructions only start blocks) or before an
+    overwritten instruction. Parameters which have been overwritten are read from the memory when the block is
+    executed, instead of being constants, and are not code cells of the block. The first instruction's opcode is always
+    a code cell, as input and halt instructions are compiled even once overwritten. Each instruction is executed by a
+    single statement, so that an instruction raising an exception is not partially executed. Writes are followed by a
+    check of whether a code cell has been overwritten, given as a (written address, next instruction pointer, number of
+    instructions executed) tuple to be generated along with the block's function, once the code cells are known.
+
+    Each statement is stored along with the address of its instruction and the number of instructions of the block
+    executed before it. Jumps add the number of instructions executed to the function's n variable, so that the
+    instructions are counted once per block instead of once per instruction.
+
+    Instructions using negative addresses raise an IndexError before changing anything, so that they are executed by
+    the slow path too. Relative addresses are checked once for all the instructions using the same relative base, by
+    comparing it to the lowest base giving no negative address.
+
+    The block's targets are the constant addresses it may jump to. When the block ends with a jump right after writing
+    a constant, this constant is a target too, as it is likely to be a return address.
+    '''
+    start = end = pointer
+    statements = []
+    targets = []
+    constants = [] # Constant written by each instruction
+    closed = False # Whether the block ends with a taken jump or the end of the program
+    # Statement index, address, number of instructions executed and lowest offset of the relative addresses checked
+    # together, None when rb changes
+    relative_checks = []
+
+    def emit(statement):
+        statements.append((statement, pointer, len(constants) - 1))
+
+    def check(*params):
+        for mode, arg in params:
+            if mode == 1:
+                continue
+            if isinstance(arg, str):
+                emit(f'if {address(mode, arg)} < 0: raise IndexError')
+            elif mode == 0 and arg < 0:
+                emit('raise IndexError')
+            elif mode == 2:
+                if not relative_checks or relative_checks[-1] is None:
+                    relative_checks.append([len(statements), pointer, len(constants) - 1, arg])
+                relative_checks[-1][3] = min(relative_checks[-1][3], arg)
+
+    def render(value):
+        return value if isinstance(value, str) or value >= 0 else f'({value})'
+
+    def param(mode, arg):
+        # Constant values are kept as int
+        return arg if mode == 1 else f'c[{address(mode, arg)}]'
+
+    def address(mode, arg):
+        if mode == 0 or arg == 0:
+            return arg if mode == 0 else 'rb'
+        return f'rb + {arg}' if isinstance(arg, str) or arg > 0 else f'rb - {-arg}'
+
+    def write(mode, arg, value, next_pointer):
+        constants[-1] = value
+        emit(f'c[{address(mode, arg)}] = {render(value)}')
+        emit((address(mode, arg), next_pointer, len(constants)))
+
+    def jump(mode, arg, condition=None):
+        # Negative targets raise an IndexError, so that the slow path reports them
+        guard = f'if {condition}: ' if condition is not None else ''
+        if mode == 1 and isinstance(arg, int):
+            if arg < 0:
+                emit(f'{guard}raise IndexError')
+                return
+            targets.append(arg)
+            emit(f'{guard}n += {len(constants)}; p = {arg}; continue')
+            return
+        both = f'{condition} and ' if condition is not None else ''
+        emit(f'if {both}(p := {param(mode, arg)}) >= 0: n += {len(constants)}; continue')
+        emit(f'{guard}raise IndexError')
+
+    while len(statements) < max_block_length:
+        try:
+            opcode, mode1, mode2, mode3, size = decode_format(memory[pointer])
+        except Exception:
+            if pointer == start:
+                raise
+            break # The error will be reported when the block starting here is compiled
+        if opcode == 3 and pointer != start:
+            break
+        if pointer in compiled.modified_cells:
+            if pointer == start and opcode not in [3, 99]:
+                return None
+            if pointer != start:
+                break
+        arg1, arg2, arg3 = [(f'c[{pointer + i}]' if pointer + i in compiled.modified_cells else memory[pointer + i])
+                            if i < size else 0 for i in range(1, 4)]
+        next_pointer = end = pointer + size
+        constants.append(None)
+
+        if opcode in [1, 2, 7, 8]:
+            check((mode1, arg1), (mode2, arg2), (mode3, arg3))
+            param1, param2 = param(mode1, arg1), param(mode2, arg2)
+            if isinstance(param1, int) and isinstance(param2, int):
+                value = {1: lambda: param1 + param2, 2: lambda: param1 * param2,
+                         7: lambda: 1 if param1 < param2 else 0, 8: lambda: 1 if param1 == param2 else 0}[opcode]()
+            elif opcode == 1 and 0 in [param1, param2]:
+                value = param2 if param1 == 0 else param1
+            elif opcode == 2 and 1 in [param1, param2]:
+                value = param2 if param1 == 1 else param1
+            elif opcode == 2 and 0 in [param1, param2]:
+                value = 0
+            else:
+                value = {1: '{} + {}', 2: '{} * {}', 7: '1 if {} < {} else 0',
+                         8: '1 if {} == {} else 0'}[opcode].format(render(param1), render(param2))
+            write(mode3, arg3, value, next_pointer)
+        elif opcode in [5, 6]:
+            check((mode1, arg1), (mode2, arg2))
+            condition = param(mode1, arg1)
+            if isinstance(condition, int):
+                if (condition != 0) == (opcode == 5):
+                    jump(mode2, arg2)
+                    closed = True
+                    break
+            else:
+                jump(mode2, arg2, f'{"" if opcode == 5 else "not "}{condition}')
+        elif opcode == 3:
+            emit('v = r()')
+            emit('if v is None: return p, rb, True, n')
+            check((mode1, arg1))
+            write(mode1, arg1, 'v', next_pointer)
+        elif opcode == 4:
+            check((mode1, arg1))
+            emit(f'o.append({param(mode1, arg1)})')
+            emit(f'if len(o) == l: return {next_pointer}, rb, False, n + {len(constants)}')
+            pointer = next_pointer
+            break
+        elif opcode == 9:
+            check((mode1, arg1))
+            emit(f'rb += {render(param(mode1, arg1))}')
+            relative_checks.append(None)
+        else:
+            emit(f'return None, rb, False, n + {len(constants)}')
+            closed = True
+            break
+        pointer = next_pointer
+    if not closed:
+        jump(1, pointer)
+    elif opcode in [5, 6] and len(constants) > 1 and isinstance(constants[-2], int):
+        targets.append(constants[-2])
+    for index, checked, executed, lowest in reversed([checks for checks in relative_checks if checks is not None]):
+        statements.insert(index, (f'if rb < {-lowest}: raise IndexError', checked, executed))
+
+    block = CompiledBlock(statements, targets, end)
+    compiled.blocks[start] = block
+    compiled.code_cells.update(cell for cell in range(start, end)
+                               if cell == start or cell not in compiled.modified_cells)
+    if not compiled.unchecked_cells.isdisjoint(range(start, end)):
+        clear_functions(compiled)
+    compiled.nb_runs = 0
+    return block
+
+def discover_blocks(memory, compiled, pointer):
+    # type: (NewProgram or ArrayMemory, CompiledProgram, int) -> Optional[CompiledBlock]
+    '''
+    Compiles the block starting at a given address, then the blocks which are statically reachable from it (jumps to
+    constant addresses). Returns the first block, or None if the instruction at this address must be interpreted.
+    '''
+    block = compile_block(memory, compiled, pointer)
+    pending = list(block.targets) if block is not None else []
+    while pending:
+        target = pending.pop()
+        if target < 0 or target in compiled.blocks:
+            continue
+        try:
+            reached = compile_block(memory, compiled, target)
+        except Exception:
+            continue # The target may be data, as long as it is not reached
+        if reached is not None:
+            pending.extend(reached.targets)
+    return block
+
+@lru_cache(maxsize=256)
+def build_function(source, lines):
+    # type: (Text, Tuple[Optional[Tuple[int, int]], ...]) -> Callable
+    '''
+    Compiles the source of a program to a Python function. Identical programs share the same function.
+    '''
+    namespace = dict()
+    exec(compile(source, '<intcode>', 'exec'), namespace)
+    function = namespace['intcode']
+    function.lines = lines
+    return function
+
+def clear_functions(compiled):
+    # type: (CompiledProgram) -> None
+    '''
+    Removes all the functions of a program, so that a single function is generated for all its blocks.
+    '''
+    compiled.functions.clear()
+    compiled.unchecked_cells.clear()
+    compiled.nb_functions = 0
+
+def generate_functions(compiled, nb_blocks=None):
+    # type: (CompiledProgram, Optional[int]) -> None
+    '''
+    Generates the functions executing the compiled blocks of a program which are not executed by a function yet, each
+    function executing up to nb_blocks blocks (all of them if None).
+    '''
+    starts = sorted(start for start in compiled.blocks if start not in compiled.functions)
+    nb_blocks = nb_blocks or len(starts)
+    for index in range(0, len(starts), nb_blocks):
+        generate_function(compiled, starts[index:index + nb_blocks])
+
+def generate_function(compiled, starts):
+    # type: (CompiledProgram, List[int]) -> Callable
+    '''
+    Generates the function executing some compiled blocks of a program, given by their sorted addresses.
+
+    The function takes the memory cells, the relative base, the output list, the input reader, the code cells, the
+    function to call when a code cell is overwritten, the instruction pointer and the output limit. It dispatches
+    between the blocks with a binary tree of tests on the instruction pointer, and returns the instruction pointer, the
+    relative base, whether the program waits for input and the number of instructions executed when the program
+    overwrites code cells, reaches the output limit, reaches an address which is not one of its blocks or waits for
+    input (the instruction pointer being then the input instruction's address). The instruction pointer returned is
+    None when the program has ended. The address of the instruction executed by each line and the number of
+    instructions of its block executed before it are kept in the function's lines attribute.
+    '''
+    code = [('def intcode(c, rb, o, r, k, m, p, l):', None), ('    n = 0', None), ('    while True:', None)]
+
+    def dispatch(starts, indent):
+        if len(starts) > 4:
+            middle = len(starts) // 2
+            code.append((f'{indent}if p < {starts[middle]}:', None))
+            dispatch(starts[:middle], indent + '    ')
+            code.append((f'{indent}else:', None))
+            dispatch(starts[middle:], indent + '    ')
+            return
+        for index, start in enumerate(starts):
+            code.append((f'{indent}{"elif" if index else "if"} p == {start}:', None))
+            for statement, address, executed in compiled.blocks[start].statements:
+                if isinstance(statement, tuple):
+                    written, next_pointer, done = statement
+                    if isinstance(written, str):
+                        statement = f'if {written} in k: m({written}); return {next_pointer}, rb, False, n + {done}'
+                    elif written in compiled.code_cells:
+                        statement = f'm({written}); return {next_pointer}, rb, False, n + {done}'
+                    else:
+                        compiled.unchecked_cells.add(written)
+                        continue
+                code.append((f'{indent}    {statement}', (address, executed)))
+        if starts:
+            code.append((f'{indent}else:', None))
+            indent += '    '
+        code.append((f'{indent}return p, rb, False, n', None))
+
+    dispatch(starts, '        ')
+    function = build_function('\n'.join(line for line, _ in code) + '\n', tuple(location for _, location in code))
+    compiled.functions.update((start, function) for start in starts)
+    compiled.nb_functions += 1
+    return function
+
+def invalidate_blocks(compiled, address):
+    # type: (CompiledProgram, int) -> None
+    '''
+    Removes from the compiled blocks table all the blocks compiled from a memory cell that has been overwritten.
+    '''
+    compiled.modified_cells.add(address)
+    removed = [(start, block.end) for start, block in compiled.blocks.items() if start <= address < block.end]
+    if not removed:
+        return # Checked by a function generated before the blocks were removed
+    for start, _ in removed:
+        del compiled.blocks[start]
+    low, high = min(start for start, _ in removed), max(end for _, end in removed)
+    compiled.code_cells.difference_update(range(low, high))
+    for start, block in compiled.blocks.items():
+        if start < high and block.end > low:
+            compiled.code_cells.update(cell for cell in range(start, block.end)
+                                       if cell == start or cell not in compiled.modified_cells)
+    # The blocks executed by the same functions as the removed ones will be executed by a new function
+    functions = set(compiled.functions.pop(start, None) for start, _ in removed)
+    for start in [start for start, function in compiled.functions.items() if function in functions]:
+        del compiled.functions[start]
+
+def read_or_prompt(read_input):
+    # type: (Callable[[], Optional[int]]) -> int
+    '''
+    Reads an input value, asking for it on the standard input if none is available.
+    '''
+    value = read_input()
+    while not isinstance(value, int):
+        try:
+            value = int(input('Enter int value: '))
+        except ValueError:
+            pass
+    return value
+
+def execute_compiled(memory, compiled, input_channel, instruction_pointer, pause_on_input, relative_base, output,
+                     output_limit=None):
+    # type: (NewProgram or ArrayMemory, CompiledProgram, InputChannel, int, bool, int, Output, int) -> Tuple[int, int]
+    '''
+    Executes an intcode program like execute, through the function generated from its compiled blocks.
+
+    Blocks are compiled when a function reaches an address which has not been compiled yet, a function being generated
+    for them before going on. Instructions using overwritten code cells are executed by the slow path of the
+    interpreter (see execute_instruction). So is an instruction raising an IndexError or an OverflowError, the function
+    stopping before changing anything. The execution then goes on with the function.
+
+    The instructions executed are counted in the compiled blocks table, from the number of instructions returned by the
+    functions or, when they raise an exception, from the instructions of the block executed before the failing line.
+    '''
+    code_cells, functions = compiled.code_cells, compiled.functions
+    read_input = input_channel.read if pause_on_input else partial(read_or_prompt, input_channel.read)
+    modified = partial(invalidate_blocks, compiled)
+    pointer = instruction_pointer
+    function = None
+    nb_instructions = 0
+    try:
+        while True:
+            cells = getattr(memory, 'cells', memory)
+            value = None
+            try:
+                while True:
+                    function = functions.get(pointer)
+                    if function is None:
+                        if pointer not in compiled.blocks:
+                            try:
+                                if discover_blocks(memory, compiled, pointer) is None:
+                                    break
+                            except Exception:
+                                print(f'Pointer: {pointer}')
+                                raise
+                        generate_functions(compiled, function_blocks)
+                        function = functions[pointer]
+                    elif compiled.nb_functions > 1 and compiled.nb_runs > merge_runs:
+                        clear_functions(compiled)
+                        generate_functions(compiled)
+                        function = functions[pointer]
+                    compiled.nb_runs += 1
+                    pointer, relative_base, waiting, executed = function(cells, relative_base, output, read_input,
+                                                                         code_cells, modified, pointer, output_limit)
+                    nb_instructions += executed
+                    if pointer is None:
+                        return -1, relative_base
+                    if waiting:
+                        return pointer, relative_base
+                    if len(output) == output_limit:
+                        return pointer, relative_base
+
+            except (IndexError, OverflowError) as error:
+                traceback = error.__traceback__
+                while traceback.tb_next is not None:
+                    traceback = traceback.tb_next
+                if function is None or traceback.tb_frame.f_code is not function.__code__:
+                    raise
+                pointer, executed = function.lines[traceback.tb_lineno - 1]
+                relative_base = traceback.tb_frame.f_locals['rb']
+                value = traceback.tb_frame.f_locals.get('v')
+                nb_instructions += traceback.tb_frame.f_locals['n'] + executed
+
+            instruction = decode_instruction(memory, decode_program(), pointer)
+            opcode, address = instruction[0], None
+            nb_instructions += 1
+            if opcode in written_params:
+                mode, arg = instruction[2 * written_params[opcode] - 1:2 * written_params[opcode] + 1]
+                address = arg if mode == 0 else relative_base + arg
+            if opcode == 3:
+                memory[address] = value
+                pointer += 2
+            else:
+                pointer, relative_base = execute_instruction(memory, decode_program(), instruction, pointer,
+                                                             relative_base, output)
+            if address in code_cells:
+                invalidate_blocks(compiled, address)
+            if len(output) == output_limit:
+                return pointer, relative_base
+    finally:
+        compiled.nb_instructions += nb_instructions
+
+class Profiler():
+    '''
+    Statistics of the intcode programs executed while the profiler is enabled.
+
+    A profiler is enabled for a single computer by giving it when creating it, or for all the programs executed in a
+    with block. Programs are then executed by execute_profiled, one instruction at a time, instead of their usual
+    engine, so that profiling costs nothing when it is not enabled.
+    '''
+    opcode_names = {1: 'add', 2: 'mul', 3: 'in', 4: 'out', 5: 'jnz', 6: 'jz', 7: 'lt', 8: 'eq', 9: 'arb', 99: 'halt'}
+
+    def __init__(self):
+        # type: () -> None
+        self.opcodes = defaultdict(int) # type: Dict[int, int]
+        self.addresses = defaultdict(int) # type: Dict[int, int]
+        self.branches = defaultdict(lambda: [0, 0]) # type: Dict[int, List[int]]
+        self.high_water = 0
+        self.runs = [] # type: List[Tuple[int, float]]
+
+    def __enter__(self):
+        # type: () -> Profiler
+        enabled_profilers.append(self)
+        return self
+
+    def __exit__(self, *_):
+        enabled_profilers.remove(self)
+
+    def as_dict(self):
+        # type: () -> Dict
+        '''
+        Returns the statistics: executions of each opcode and address, how many times each jump has been taken and
+        reached, highest address written, and number of instructions executed and wall time of each run.
+        '''
+        return {'opcodes': {self.opcode_names[opcode]: count for opcode, count in self.opcodes.items()},
+                'addresses': dict(self.addresses),
+                'branches': {address: {'taken': taken, 'total': total, 'ratio': taken / total}
+                             for address, (taken, total) in self.branches.items()},
+                'high_water': self.high_water,
+                'runs': [{'instructions': instructions, 'time': time} for instructions, time in self.runs]}
+
+    def report(self, sort_by='count', limit=10):
+        # type: (Text, int) -> Text
+        '''
+        Returns the statistics as text, opcodes, addresses and jumps being sorted by count (most executed first) or by
+        address, and only the first limit addresses and jumps being listed.
+        '''
+        def order(items):
+            if sort_by == 'count':
+                return sorted(items, key=lambda item: (-item[1], item[0]))
+            if sort_by == 'address':
+                return sorted(items)
+            raise Exception(f'Unknown sort order: {sort_by}')
+
+        instructions = sum(instructions for instructions, _ in self.runs)
+        lines = [f'{len(self.runs)} runs, {instructions} instructions in {sum(time for _, time in self.runs):.6f}s, '
+                 f'highest address written {self.high_water}', 'Opcodes:']
+        lines += [f'  {self.opcode_names[opcode]:>5} {count:>10}' for opcode, count in order(self.opcodes.items())]
+        lines.append('Addresses:')
+        lines += [f'  {address:>8} {count:>10}' for address, count in order(self.addresses.items())[:limit]]
+        lines.append('Jumps (taken / reached):')
+        jumps = order([(address, total) for address, (_, total) in self.branches.items()])[:limit]
+        lines += [f'  {address:>8} {taken:>10} / {total:<10} {taken / total:.1%}'
+                  for address, total in jumps for taken in [self.branches[address][0]]]
+        return '\n'.join(lines)
+
+# Profilers enabled by with blocks, the last one being used by the programs started meanwhile
+enabled_profilers = [] # type: List[Profiler]
+
+def execute_profiled(profiler, memory, decoded, input_channel, instruction_pointer, pause_on_input, relative_base,
+                     output, output_limit=None):
+    # type: (Profiler, NewProgram or ArrayMemory, DecodedProgram, InputChannel, int, bool, int, Output, int) -> Tuple[int, int]
+    '''
+    Executes an intcode program like execute, one instruction at a time, recording its statistics in the profiler.
+    '''
+    opcodes, addresses, branches = profiler.opcodes, profiler.addresses, profiler.branches
+    start_time = perf_counter()
+    pointer = instruction_pointer
+    nb_instructions = 0
+    while True:
+        instruction = decoded.instructions.get(pointer) or decode_instruction(memory, decoded, pointer)
+        opcode, mode1, arg1 = instruction[:3]
+        if opcode == 3:
+            value = input_channel.read()
+            if value is None and pause_on_input:
+                break
+            value = read_or_prompt(lambda: value)
+        nb_instructions += 1
+        opcodes[opcode] += 1
+        addresses[pointer] += 1
+        if opcode == 99:
+            pointer = -1
+            break
+
+        if opcode == 3:
+            address = arg1 if mode1 == 0 else relative_base + arg1
+            memory[address] = value
+            if address in decoded.code_cells:
+                invalidate_instructions(decoded, address)
+            profiler.high_water = max(profiler.high_water, address)
+            pointer += 2
+        else:
+            if opcode in written_params:
+                mode, arg = instruction[5:7]
+                profiler.high_water = max(profiler.high_water, arg if mode == 0 else relative_base + arg)
+            if opcode in [5, 6]:
+                condition = arg1 if mode1 == 1 else memory[arg1 if mode1 == 0 else relative_base + arg1]
+                branches[pointer][0] += (condition != 0) == (opcode == 5)
+                branches[pointer][1] += 1
+            pointer, relative_base = execute_instruction(memory, decoded, instruction, pointer, relative_base, output)
+            if len(output) == output_limit:
+                break
+
+    profiler.runs.append((nb_instructions, perf_counter() - start_time))
+    decoded.nb_instructions += nb_instructions
+    return pointer, relative_base
+
+def select_engine(compiled=True, profiler=None):
+    # type: (bool, Optional[Profiler]) -> Tuple[Callable, DecodedProgram or CompiledProgram]
+    '''
+    Returns the function executing programs and the empty table it uses: the profiled interpreter if a profiler is
+    given or enabled, otherwise the compiled blocks engine or the interpreter.
+    '''
+    profiler = profiler or (enabled_profilers[-1] if enabled_profilers else None)
+    if profiler is not None:
+        return partial(execute_profiled, profiler), decode_program()
+    if compiled:
+        return execute_compiled, compile_program()
+    return execute, decode_program()
+
+def run_program(program, input_list=(), instruction_pointer=0, pause_on_input=False, relative_base = 0):
     # type: (NewProgram or Program, Input, int, bool, int) -> Tuple[NewProgram, Output, int, int]
     '''
     Executes an intcode program.
+
+    Kept for compatibility, the program is copied and executed by the compiled blocks engine, unless a profiler is
+    enabled. The input list is not modified.
     '''
     if type(program) == list:
         program = convert_program(program)
     else:
         program = program.copy()
 
-    def halt(message):
-        print(f'Program: {program}')
-        print(f'Pointer: {instruction_pointer}')
-        raise Exception(message)
-
-    def get_param_value(instruction, param_number):
-        mode = instruction[-param_number - 2:-param_number - 1]
-        if mode == '0':
-            return program[program[instruction_pointer + param_number]]
-        if mode == '1':
-            return program[instruction_pointer + param_number]
-        if mode == '2':
-            return program[relative_base + program[instruction_pointer + param_number]]
-        halt(f'Unknown parameter mode: {mode}')
-
-    def position_only(instruction, param_number):
-        if instruction[-param_number - 2:-param_number - 1] not in ['0', '2']:
-            halt(f'Parameter {param_number} must be in position or relative mode')
-
-    def write_result(instruction, param_number, value):
-        mode = instruction[-param_number -2:-param_number - 1]
-        if mode == '0':
-            program[program[instruction_pointer + param_number]] = value
-        if mode == '2':
-            program[relative_base + program[instruction_pointer + param_number]] = value
-
     output = []
-    while instruction_pointer < len(program):
-        instruction = f'{program[instruction_pointer]:05d}'
-        opcode = int(instruction[-2:])
-        if opcode in [1, 2, 7, 8]:
-            position_only(instruction, 3)
-            param1 = get_param_value(instruction, 1)
-            param2 = get_param_value(instruction, 2)
-            if opcode == 1:
-                write_result(instruction, 3, param1 + param2)
-            elif opcode == 2:
-                write_result(instruction, 3, param1 * param2)
-            elif opcode == 7:
-                write_result(instruction, 3, 1 if param1 < param2 else 0)
-            elif opcode == 8:
-                write_result(instruction, 3, 1 if param1 == param2 else 0)
-            instruction_pointer += 4
-            continue
+    engine, decoded = select_engine()
+    instruction_pointer, relative_base = engine(program, decoded, InputChannel(input_list), instruction_pointer,
+                                                pause_on_input, relative_base, output)
+    return program, output, instruction_pointer, relative_base
 
-        if opcode in [5, 6]:
-            param = get_param_value(instruction, 1)
-            if (opcode == 5 and param != 0) or (opcode == 6 and param == 0):
-                instruction_pointer = get_param_value(instruction, 2)
-            else:
-                instruction_pointer += 3
-            continue
+class IntcodeVM():
+    '''
+    Intcode computer keeping its memory, instruction pointer and relative base between runs.
 
-        if opcode == 3:
-            position_only(instruction, 1)
-            value = None
-            while not isinstance(value, int):
-                try:
-                    if not input_list and pause_on_input:
-                        return program, output, instruction_pointer, relative_base
-                    value = input_list.pop(0) if input_list else int(input('Enter int value: '))
-                except ValueError:
-                    pass
-            write_result(instruction, 1, value)
-            instruction_pointer += 2
-            continue
+    The program is copied once when the computer is created, then runs are resumed from where they stopped without
+    copying the memory again, so that the cost of each exchange with the program does not depend on its size.
 
-        if opcode == 4:
-            output.append(get_param_value(instruction, 1))
-            instruction_pointer += 2
-            continue
+    The memory is an ArrayMemory, unless another memory_type is given (e.g. convert_program for a dictionary). Input
+    values can be given as a list, or as an InputChannel to read them from an iterator or a callback. The program is
+    compiled to Python functions (see execute_compiled) unless compiled is False, in which case it is interpreted. It
+    is interpreted with profiling if a profiler is given, or enabled when the computer is created.
+    '''
+    def __init__(self, program, input_list=(), memory_type=None, compiled=True, profiler=None):
+        # type: (NewProgram or Program, Input or InputChannel, Callable[[NewProgram or Program], NewProgram or ArrayMemory], bool, Profiler) -> None
+        self.memory = (memory_type or ArrayMemory)(program)
+        self.profiler = profiler or (enabled_profilers[-1] if enabled_profilers else None)
+        self.engine, self.decoded = select_engine(compiled, self.profiler)
+        self.pointer = 0
+        self.relative_base = 0
+        self.input_channel = input_list if isinstance(input_list, InputChannel) else InputChannel(input_list)
 
-        if opcode == 9:
-            relative_base += get_param_value(instruction, 1)
-            instruction_pointer += 2
-            continue
+    @property
+    def halted(self):
+        # type: () -> bool
+        '''
+        Whether the program has reached its end.
+        '''
+        return self.pointer == -1
 
-        if opcode == 99:
-            break
-        halt(f'Unknown opcode: {opcode}')
+    @property
+    def nb_instructions(self):
+        # type: () -> int
+        '''
+        Number of instructions executed by the program.
+        '''
+        return self.decoded.nb_instructions
+
+    def feed(self, values):
+        # type: (Input) -> IntcodeVM
+        '''
+        Adds values to the input queue of the program.
+        '''
+        self.input_channel.feed(values)
+        return self
+
+    def run_until_output(self, nb_output=None, output=None):
+        # type: (int, Output) -> Output
+        '''
+        Runs the program until it has produced nb_output values, waits for input or ends, and returns its output.
+
+        The output is added to the given list, if any, so that an input callback can read it while the program runs
+        (it may then clear the list, unless nb_output is given).
+        '''
+        if output is None:
+            output = []
+        if not self.halted:
+            self.pointer, self.relative_base = self.engine(self.memory, self.decoded, self.input_channel, self.pointer,
+                                                           True, self.relative_base, output, nb_output)
+        return output
+
+    def run_until_input(self):
+        # type: () -> Output
+        '''
+        Runs the program until it waits for input or ends, and returns its output.
+        '''
+        return self.run_until_output()
+
+    def iterate_output(self, batch_size=4096):
+        # type: (int) -> Iterator[Output]
+        '''
+        Runs the program until it waits for input or ends, lazily generating its output by batches of batch_size
+        values, so that long outputs can be processed while they are produced.
+        '''
+        while not self.halted:
+            output = self.run_until_output(batch_size)
+            if output:
+                yield output
+            if len(output) < batch_size:
+                return
+
+    def fork(self):
+        # type: () -> IntcodeVM
+        '''
+        Creates an independent copy of the computer in its current state.
+
+        Only the memory (a single block copy for an ArrayMemory), the decoded instructions or compiled blocks table
+        and the queued input values are copied, so forks are cheap snapshots from which several continuations of a
+        common execution can be explored. An input callback is shared by the copies.
+        '''
+        vm = IntcodeVM.__new__(IntcodeVM)
+        vm.memory = self.memory.copy()
+        vm.decoded = self.decoded.copy()
+        vm.engine = self.engine
+        vm.profiler = self.profiler
+        vm.pointer = self.pointer
+        vm.relative_base = self.relative_base
+        vm.input_channel = InputChannel(self.input_channel.queue, self.input_channel.callback)
+        return vm
+
+class IntcodeNetwork():
+    '''
+    Scheduler running intcode computers whose outputs are sent as input to other computers.
+
+    Computers are connected in any graph, the outputs of a computer being fed to each of its targets in the order they
+    were connected. Only the computers with pending input are run, each until it waits for input again or ends, so
+    that no computer is run just to find it still waiting. Computers are resumed where they stopped, without copying
+    their memory, so the network can host thousands of them. The number of runs and of instructions executed by each
+    computer are counted.
+    '''
+    def __init__(self):
+        # type: () -> None
+        self.vms = [] # type: List[IntcodeVM]
+        self.targets = [] # type: List[List[int]]
+        self.watched = {} # type: Dict[int, Output]
+        self.nb_runs = [] # type: List[int]
+        self.nb_instructions = [] # type: List[int]
+        self.ready = deque() # type: deque[int]
+        self.scheduled = [] # type: List[bool]
 
-    return program, output, -1, relative_base
+    def add(self, vm):
+        # type: (IntcodeVM) -> int
+        '''
+        Adds a computer to the network, scheduled to run until its first input, and returns its index.
+        '''
+        index = len(self.vms)
+        self.vms.append(vm)
+        self.targets.append([])
+        self.nb_runs.append(0)
+        self.nb_instructions.append(0)
+        self.scheduled.append(True)
+        self.ready.append(index)
+        return index
+
+    def connect(self, source, target):
+        # type: (int, int) -> None
+        '''
+        Sends the output of the source computer to the input of the target computer.
+        '''
+        self.targets[source].append(target)
+
+    def watch(self, index):
+        # type: (int) -> Output
+        '''
+        Returns the list to which the next outputs of a computer are added, in addition to being sent to its targets.
+        '''
+        return self.watched.setdefault(index, [])
+
+    def send(self, index, values):
+        # type: (int, Input) -> None
+        '''
+        Adds values to the input of a computer, scheduling it to run.
+        '''
+        self.vms[index].feed(values)
+        if not self.scheduled[index]:
+            self.scheduled[index] = True
+            self.ready.append(index)
+
+    def run(self):
+        # type: () -> None
+        '''
+        Runs the scheduled computers until all of them have ended or wait for input no other computer will send.
+        '''
+        while self.ready:
+            index = self.ready.popleft()
+            self.scheduled[index] = False
+            vm = self.vms[index]
+            if vm.halted:
+                continue
+            nb_instructions = vm.nb_instructions
+            output = vm.run_until_input()
+            self.nb_runs[index] += 1
+            self.nb_instructions[index] += vm.nb_instructions - nb_instructions
+            if output:
+                if index in self.watched:
+                    self.watched[index].extend(output)
+                for target in self.targets[index]:
+                    self.send(target, output)
+
+    @property
+    def halted(self):
+        # type: () -> bool
+        '''
+        Whether all the computers have reached their end.
+        '''
+        return all(vm.halted for vm in self.vms)
+
+class AsyncIntcodeVM():
+    '''
+    Asyncio front end of an intcode computer, so that many programs can be driven concurrently by coroutines.
+
+    Values are written to the program with await write(...) and its outputs read with await read(). The program runs
+    by batches of at most batch_size outputs, letting the other coroutines run between batches. A coroutine reading
+    while the program waits for input is suspended until another one writes to it.
+    '''
+    def __init__(self, vm, batch_size=256):
+        # type: (IntcodeVM, int) -> None
+        self.vm = vm
+        self.batch_size = batch_size
+        self.output = deque() # type: deque[int]
+        self.input_written = asyncio.Event()
+
+    @property
+    def halted(self):
+        # type: () -> bool
+        '''
+        Whether the program has reached its end and all its outputs have been read.
+        '''
+        return self.vm.halted and not self.output
+
+    async def write(self, *values):
+        # type: (*int) -> None
+        '''
+        Adds values to the input of the program, which runs when its outputs are read.
+        '''
+        self.vm.feed(values)
+        self.input_written.set()
+
+    async def resume(self):
+        # type: () -> bool
+        '''
+        Runs the next batch of the program, then lets the other coroutines run. Returns whether the program waits for
+        input.
+        '''
+        self.input_written.clear()
+        output = self.vm.run_until_output(self.batch_size)
+        self.output.extend(output)
+        await asyncio.sleep(0)
+        return len(output) < self.batch_size and not self.vm.halted
+
+    async def read(self):
+        # type: () -> Optional[int]
+        '''
+        Returns the next output of the program, or None if it has ended.
+        '''
+        while not self.output:
+            if self.vm.halted:
+                return None
+            if await self.resume() and not self.output:
+                await self.input_written.wait()
+        return self.output.popleft()
+
+    async def read_until_input(self):
+        # type: () -> Output
+        '''
+        Returns the outputs of the program until it waits for input not written yet, or ends.
+        '''
+        while not self.vm.halted and not await self.resume():
+            pass
+        output = list(self.output)
+        self.output.clear()
+        return output
 
 def convert_program(program):
-    # type: (Program) -> NewProgram
+    # type: (Program or NewProgram) -> NewProgram
     '''
-    Convert old programs (list) to new programs (dict).
+    Convert old programs (list) to new programs (dict). New programs are copied.
     '''
+    if isinstance(program, dict):
+        return defaultdict(lambda: 0, program)
     return defaultdict(lambda: 0, enumerate(program))
 
-def run_program_compat(program, return_output = False, input_list=[], instruction_pointer=0, pause_on_input=False):
-    # type: (Program, bool, Input, int, bool) -> Tuple[Program, Output, int] or Tuple[Program, Output] or Program
+def run_program_compat(program, return_output = False, input_list=(), instruction_pointer=0, pause_on_input=False,
+                       memory_type=None):
+    # type: (Program, bool, Input, int, bool, Callable[[Program], NewProgram or ArrayMemory]) -> Tuple[Program, Output, int] or Tuple[Program, Output] or Program
     '''
-    Executes old programs on the new computer.
+    Executes old programs on the new computer, using an ArrayMemory unless another memory_type is given.
     '''
-    program, output, pointer, _ = run_program(convert_program(program), input_list, instruction_pointer, pause_on_input, 0)
+    memory = (memory_type or ArrayMemory)(program)
+    output = []
+    engine, decoded = select_engine(compiled=False)
+    engine(memory, decoded, InputChannel(input_list), instruction_pointer, pause_on_input, 0, output)
 
-    program = list(program.values())
+    program = list(memory.values())
 
     if pause_on_input:
         return program, output, -1
@@ -122,6 +1238,210 @@ def run_program_compat(program, return_output = False, input_list=[], instructio
         return program, output
     return program
 
+class SymbolicState():
+    '''
+    State of an intcode program partially evaluated without knowing its input values.
+
+    Memory cells holding a value depending on the inputs are listed in unknown, with the index of the register which
+    will hold their value when the program is run.
+    '''
+    def __init__(self, memory, unknown, pointer, relative_base, nb_registers, nb_inputs):
+        # type: (ArrayMemory, Dict[int, int], int, int, int, int) -> None
+        self.memory = memory
+        self.unknown = unknown
+        self.pointer = pointer
+        self.relative_base = relative_base
+        self.nb_registers = nb_registers
+        self.nb_inputs = nb_inputs
+
+    def copy(self):
+        # type: () -> SymbolicState
+        return SymbolicState(self.memory.copy(), dict(self.unknown), self.pointer, self.relative_base,
+                             self.nb_registers, self.nb_inputs)
+
+class ResidualNode():
+    '''
+    Straight-line part of a partially evaluated program, compiled to a Python function, and how it ends.
+
+    A node ends when the program halts ('halt'), on a jump depending on the inputs ('branch', the following nodes being
+    built the first time each way is taken) or when the program can't be evaluated further without knowing the inputs
+    ('exit', the execution then goes on in an IntcodeVM). The target of a branch is kept as the mode and value of the
+    jump's parameter, as it is only read if the jump is taken.
+    '''
+    def __init__(self, code, kind, state=None, condition=None, jump_if_true=True, target=None):
+        # type: (List[Text], Text, SymbolicState, int, bool, Tuple[int, int]) -> None
+        source = 'def residual(r, i, o):\n    ' + ('\n    '.join(code) if code else 'pass')
+        namespace = dict()
+        exec(compile(source, '<residual>', 'exec'), namespace)
+        self.function = namespace['residual']
+        self.kind = kind
+        self.state = state
+        self.condition = condition
+        self.jump_if_true = jump_if_true
+        self.target = target
+        self.children = dict()
+
+class ResidualProgram():
+    '''
+    Intcode program specialized by partial evaluation, for repeated runs with different inputs.
+
+    The program is executed once without its inputs: instructions which don't depend on them are evaluated, and the
+    others are emitted as a residual Python function of the inputs. Jumps depending on the inputs split the residual
+    program, each way being specialized the first time it is taken. Operations which can't be specialized (unknown
+    relative base, address of an instruction or jump target, ...) fall back to an IntcodeVM, started from the state
+    reached so far.
+
+    Running the residual program gives the same output as running the program with all its inputs given upfront.
+    '''
+    def __init__(self, program, max_length=10000):
+        # type: (NewProgram or Program, int) -> None
+        self.program = program
+        self.max_length = max_length
+        self.root = self.specialize(SymbolicState(ArrayMemory(program), dict(), 0, 0, 0, 0))
+
+    def specialize(self, state):
+        # type: (SymbolicState) -> ResidualNode
+        '''
+        Partially evaluates the program from a given state, until the end of the straight-line part reached.
+        '''
+        memory, unknown = state.memory, state.unknown
+        code = []
+
+        def value(mode, arg):
+            if mode == 1:
+                return arg
+            address = arg if mode == 0 else state.relative_base + arg
+            return f'r[{unknown[address]}]' if address in unknown else memory[address]
+
+        def write(mode, arg, result):
+            address = arg if mode == 0 else state.relative_base + arg
+            if isinstance(result, str):
+                code.append(f'r.append({result})')
+                unknown[address] = state.nb_registers
+                state.nb_registers += 1
+                memory[address] = 0
+            else:
+                unknown.pop(address, None)
+                memory[address] = result
+
+        while len(code) < self.max_length:
+            pointer = state.pointer
+            if pointer in unknown:
+                break
+            try:
+                opcode, mode1, mode2, mode3, size = decode_format(memory[pointer])
+            except Exception:
+                break # The IntcodeVM will report the error
+            if any(address in unknown for address in range(pointer + 1, pointer + size)):
+                break
+            arg1, arg2, arg3 = [memory[pointer + i] for i in range(1, 4)]
+
+            if opcode in [1, 2, 7, 8]:
+                param1, param2 = value(mode1, arg1), value(mode2, arg2)
+                if not isinstance(param1, str) and not isinstance(param2, str):
+                    result = {1: lambda: param1 + param2, 2: lambda: param1 * param2,
+                              7: lambda: 1 if param1 < param2 else 0, 8: lambda: 1 if param1 == param2 else 0}[opcode]()
+                elif opcode == 1 and 0 in [param1, param2]:
+                    result = param2 if param1 == 0 else param1
+                elif opcode == 2 and 0 in [param1, param2]:
+                    result = 0
+                elif opcode == 2 and 1 in [param1, param2]:
+                    result = param2 if param1 == 1 else param1
+                else:
+                    result = {1: '{} + {}', 2: '{} * {}', 7: '1 if {} < {} else 0',
+                              8: '1 if {} == {} else 0'}[opcode].format(param1, param2)
+                write(mode3, arg3, result)
+                state.pointer += 4
+
+            elif opcode in [5, 6]:
+                condition = value(mode1, arg1)
+                if isinstance(condition, str):
+                    condition = unknown[arg1 if mode1 == 0 else state.relative_base + arg1]
+                    return ResidualNode(code, 'branch', state, condition, opcode == 5, (mode2, arg2))
+                if (condition != 0) == (opcode == 5):
+                    target = value(mode2, arg2)
+                    if isinstance(target, str):
+                        break
+                    state.pointer = target
+                else:
+                    state.pointer += 3
+
+            elif opcode == 3:
+                write(mode1, arg1, f'i[{state.nb_inputs}]')
+                state.nb_inputs += 1
+                state.pointer += 2
+
+            elif opcode == 4:
+                code.append(f'o.append({value(mode1, arg1)})')
+                state.pointer += 2
+
+            elif opcode == 9:
+                offset = value(mode1, arg1)
+                if isinstance(offset, str):
+                    break
+                state.relative_base += offset
+                state.pointer += 2
+
+            else:
+                return ResidualNode(code, 'halt')
+
+        return ResidualNode(code, 'exit', state)
+
+    def follow(self, node, taken):
+        # type: (ResidualNode, bool) -> ResidualNode
+        '''
+        Specializes the program after a branch, for the given way.
+        '''
+        state = node.state.copy()
+        if taken:
+            mode, arg = node.target
+            address = arg if mode == 0 else state.relative_base + arg
+            if mode != 1 and (address < 0 or address in state.unknown):
+                return ResidualNode([], 'exit', state) # The VM will execute the jump, or report its error
+            state.pointer = arg if mode == 1 else state.memory[address]
+        else:
+            state.pointer += 3
+        if taken != node.jump_if_true:
+            # The condition is known to be 0 on this way
+            for address in [address for address, register in state.unknown.items() if register == node.condition]:
+                del state.unknown[address]
+                state.memory[address] = 0
+        return self.specialize(state)
+
+    def run(self, input_list):
+        # type: (Input) -> Output
+        '''
+        Runs the program with the given inputs and returns its output. The program itself is run if a profiler is
+        enabled.
+        '''
+        if enabled_profilers:
+            return IntcodeVM(self.program, input_list).run_until_input()
+        registers = []
+        output = []
+        node = self.root
+        try:
+            while True:
+                node.function(registers, input_list, output)
+                if node.kind == 'halt':
+                    return output
+                if node.kind == 'exit':
+                    break
+                taken = (registers[node.condition] != 0) == node.jump_if_true
+                if taken not in node.children:
+                    node.children[taken] = self.follow(node, taken)
+                node = node.children[taken]
+        except IndexError:
+            # The program reads more inputs than given, the VM will wait for them
+            return IntcodeVM(self.program, input_list).run_until_input()
+
+        state = node.state
+        vm = IntcodeVM(state.memory)
+        for address, register in state.unknown.items():
+            vm.memory[address] = registers[register]
+        vm.pointer = state.pointer
+        vm.relative_base = state.relative_base
+        return output + vm.feed(input_list[state.nb_inputs:]).run_until_input()
+
 def checks_d9p1():
     program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
     _, output, _, _ = run_program(convert_program(program))
@@ -135,20 +1455,198 @@ def checks_d9p1():
     _, output, _, _ = run_program(convert_program(program))
     assert output.pop() == 1125899906842624
 
+    program = [3,20,1001,20,1,20,4,20,4,20,1105,1,0]
+    vm = IntcodeVM(program, [1])
+    assert vm.run_until_output(1) == [2]
+    assert vm.run_until_input() == [2]
+    assert vm.feed([5]).run_until_input() == [6, 6]
+    assert not vm.halted
+
+    values = [4, 6]
+    vm = IntcodeVM(program, InputChannel.from_iterator(iter(values)))
+    assert vm.run_until_input() == [5, 5, 7, 7]
+    assert values == [4, 6]
+    assert IntcodeVM(program, InputChannel([1], lambda: 2)).run_until_output(4) == [2, 2, 3, 3]
+    assert list(IntcodeVM(program, [1, 2, 3, 4]).iterate_output(3)) == [[2, 2, 3], [3, 4, 4], [5, 5]]
+
+    vm = IntcodeVM(program, [1])
+    assert vm.run_until_output(1) == [2]
+    fork = vm.fork()
+    assert vm.feed([10]).run_until_input() == [2, 11, 11]
+    assert fork.feed([20]).run_until_input() == [2, 21, 21]
+
+    # Self-modifying program : the output instruction's parameter is incremented after being decoded
+    program = [104,1,1001,1,1,1,1007,1,3,20,1005,20,0,99]
+    _, output, _, _ = run_program(convert_program(program))
+    assert output == [1, 2]
+
+def checks_memory(memory_type, compiled=True):
+    vm = partial(IntcodeVM, memory_type=memory_type, compiled=compiled)
+    program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+    assert vm(program).run_until_input() == program
+
+    program = [1102,34915192,34915192,7,4,7,99,0]
+    assert len(str(vm(program).run_until_input().pop())) == 16
+
+    # Value not fitting in 64 bits
+    program = [1102,1 << 40,1 << 40,7,4,7,99,0]
+    assert vm(program).run_until_input() == [1 << 80]
+
+    program = [104,1,1001,1,1,1,1007,1,3,20,1005,20,0,99]
+    assert vm(program).run_until_input() == [1, 2]
+
+    # Writes just past the end of the program and far away from it
+    program = [1101,5,6,20,1101,7,8,10000000,1,20,10000000,21,4,21,99]
+    assert vm(program).run_until_input() == [26]
+
+    # Input written past the end of the program, then the program overwrites the next instruction
+    program = [3,13,1101,0,4,10,1101,0,13,11,104,1,99]
+    assert vm(program, [7]).run_until_input() == [7]
+    program = [203,20,4,20,99]
+    assert vm(program, [8]).run_until_input() == [8]
+
+    # Relative base changed before a write past the end of the program
+    program = [109,50,21101,3,4,0,204,0,99]
+    assert vm(program).run_until_input() == [7]
+
+    # Jumps to negative addresses, constant or computed
+    for program in [[1105,1,-1], [1106,0,-1], [1101,0,-1,20,5,20,20,99], [109,5,2105,1,0,-1]]:
+        try:
+            with redirect_stdout(io.StringIO()): # The pointer of the error is printed
+                vm(program).run_until_input()
+        except Exception as error:
+            assert memory_type is not ArrayMemory or str(error).startswith('Negative address')
+        else:
+            assert False, program
+
+    # Overwritten instruction becoming an input instruction, then overwritten again
+    program = [1101,2,1,4,104,20,1101,100,4,4,1105,1,4,99] + [0] * 10
+    assert vm(program, [7]).run_until_output(2) == [20, 20]
+
+    # Value not fitting in 64 bits moved from the sparse part when the memory grows
+    program = [1102,1 << 40,1 << 40,70000,1101,1,1,65000,1101,1,1,66000,4,70000,99]
+    assert vm(program).run_until_input() == [1 << 80]
+
+    # Negative addresses, constant or relative, and overwritten to become negative
+    if memory_type is ArrayMemory:
+        for program in [[4,-1,99,77], [1101,5,5,-1,4,3,99], [109,-5,204,1,99], [4,12,1101,0,-1,1,1105,1,0,99,0,0,42]]:
+            try:
+                vm(program).run_until_input()
+            except Exception as error:
+                assert str(error).startswith('Negative address')
+            else:
+                assert False, program
+
+def checks_residual_program():
+    checks_d5p2(lambda program, _, input_list: (None, ResidualProgram(program).run(input_list)))
+
+    program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+    assert ResidualProgram(program).run([]) == program
+
+    # The output depends on both inputs, through a jump
+    program = [3,20,3,21,1,20,21,22,1007,22,10,23,1005,23,17,104,0,4,22,99]
+    residual = ResidualProgram(program)
+    for input_list in [[1, 2], [5, 5], [4, 2], [30, -1]]:
+        assert residual.run(input_list) == IntcodeVM(program, input_list).run_until_input()
+
+    # The target of the jump depending on the input is only read when the jump is taken
+    program = [3,9,5,9,-1,104,7,99,0,0]
+    assert ResidualProgram(program).run([0]) == IntcodeVM(program, [0]).run_until_input() == [7]
+    try:
+        ResidualProgram(program).run([1])
+    except Exception as error:
+        assert str(error).startswith('Negative address')
+    else:
+        assert False
+
+def checks_profiler():
+    program = [3,20,1001,20,1,20,4,20,4,20,1105,1,0]
+    profiler = Profiler()
+    vm = IntcodeVM(program, [1], profiler=profiler)
+    assert vm.run_until_input() == [2, 2]
+    assert vm.feed([5]).run_until_output(1) == [6]
+    statistics = profiler.as_dict()
+    assert statistics['opcodes'] == {'in': 2, 'add': 2, 'out': 3, 'jnz': 1}
+    assert statistics['addresses'] == {0: 2, 2: 2, 6: 2, 8: 1, 10: 1}
+    assert statistics['branches'] == {10: {'taken': 1, 'total': 1, 'ratio': 1.0}}
+    assert statistics['high_water'] == 20
+    assert [run['instructions'] for run in statistics['runs']] == [5, 3]
+    assert profiler.report('address').splitlines()[2] == '    add          2'
+    for compiled in [True, False]:
+        vm = IntcodeVM(program, [1], compiled=compiled)
+        vm.run_until_input()
+        vm.feed([5]).run_until_output(1)
+        assert vm.nb_instructions == 8
+
+    program = [3,9,1001,9,1,9,4,9,99,0]
+    with Profiler() as profiler:
+        _, output, _, _ = run_program(program, [1])
+        assert ResidualProgram(program).run([1]) == output == [2]
+    assert len(profiler.runs) == 2 and profiler.opcodes[99] == 2
+    assert not enabled_profilers
+
+def checks_network():
+    program = [3,11,1001,11,1,11,4,11,1105,1,0,0]
+    for compiled, profiler in [(True, None), (False, None), (True, Profiler())]:
+        network = IntcodeNetwork()
+        source, left, right = (network.add(IntcodeVM(program, compiled=compiled, profiler=profiler))
+                               for _ in range(3))
+        network.connect(source, left)
+        network.connect(source, right)
+        network.connect(right, left)
+        network.send(source, [1, 5])
+        left_output, right_output = network.watch(left), network.watch(right)
+        network.run()
+        assert right_output == [3, 7]
+        assert left_output == [3, 7, 4, 8]
+        assert network.nb_instructions == [8, 16, 8]
+        assert network.nb_runs == [1, 2, 1]
+        assert not network.halted
+
+def checks_async_vm():
+    program = [3,11,1001,11,1,11,4,11,1105,1,0,0]
+
+    async def count(vm, start, trace):
+        for value in range(start, start + 3):
+            await vm.write(value)
+            trace.append(await vm.read())
+
+    async def sessions():
+        trace = []
+        await asyncio.gather(*(count(AsyncIntcodeVM(IntcodeVM(program)), start, trace) for start in [10, 20]))
+        return trace
+
+    assert asyncio.run(sessions()) == [11, 21, 12, 22, 13, 23]
+
+    async def batches():
+        vm = AsyncIntcodeVM(IntcodeVM([104,1,104,2,3,20,4,20,99]), batch_size=1)
+        first = await vm.read_until_input()
+        await vm.write(3)
+        return first, await vm.read(), await vm.read(), vm.halted
+
+    assert asyncio.run(batches()) == ([1, 2], 3, None, True)
+
 def run(with_tests: True):
     with open(os.path.dirname(__file__) + os.sep + 'input.txt', 'r') as in_file:
         program = ast.literal_eval('[' + in_file.read().strip() + ']')
 
     if with_tests:
-        checks_d2p1(run_program_compat)
-        checks_d5p2(run_program_compat)
+        for memory_type in [ArrayMemory, convert_program]:
+            checks_d2p1(partial(run_program_compat, memory_type=memory_type))
+            checks_d5p2(partial(run_program_compat, memory_type=memory_type))
+            checks_memory(memory_type)
+            checks_memory(memory_type, compiled=False)
 
         checks_d9p1()
+        checks_residual_program()
+        checks_profiler()
+        checks_network()
+        checks_async_vm()
 
-    d9p1 = run_program(convert_program(program), [1])[1].pop()
+    d9p1 = IntcodeVM(program, [1]).run_until_input().pop()
     print(f'Day 9, Part 1 : {d9p1}') # 3533056970
 
-    d9p2 = run_program(convert_program(program), [2])[1].pop()
+    d9p2 = IntcodeVM(program, [2]).run_until_input().pop()
     print(f'Day 9, Part 2 : {d9p2}') # 72852
 
 if __name__ == '__main__':